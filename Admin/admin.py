@@ -1,16 +1,47 @@
 import os
 import io
-import pandas as pd
+import sys
+import csv
+import itertools
+import tempfile
+import zlib
+import time
+import hashlib
+import hmac
+import json
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from functools import wraps
 import mysql.connector 
 from flask import Response
-from datetime import date, datetime
-from flask import Flask, render_template, jsonify, send_file, request
+from datetime import date, datetime, timedelta
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Flask, render_template, jsonify, send_file, request, make_response
 from werkzeug.utils import secure_filename
 import openpyxl
+import analytics
+
+# Shared modules (query_profiler, migrate) live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import query_profiler
+import migrate
+
+# Optional: Parquet log exports
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 # Flask app setup
 app = Flask(__name__)
 
+# Debug mode (and the reloader) only when explicitly asked for: APP_DEBUG=1
+DEBUG = os.getenv("APP_DEBUG", "0") == "1"
+app.config["DEBUG"] = DEBUG
+
 # Load DB config from environment variables for security
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
@@ -19,8 +50,450 @@ DB_CONFIG = {
     "database": os.getenv("DB_NAME", "lib_main")
 }
 
+# Times every statement; see /api/query_stats
+profiler = query_profiler.QueryProfiler("admin")
+
 def get_db_connection():
-    return mysql.connector.connect(**DB_CONFIG)
+    return profiler.wrap(mysql.connector.connect(**DB_CONFIG))
+
+def ensure_meta_table():
+    """Create the key/value table shared with the kiosk app (roster version etc.)"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS app_meta (
+                meta_key VARCHAR(64) PRIMARY KEY,
+                meta_value VARCHAR(255),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """)
+        cur.close()
+        conn.close()
+    except mysql.connector.Error as e:
+        print("Could not create app_meta table:", e)
+
+def bump_roster_version(cursor):
+    """Tell the kiosk its in-memory roster index is stale"""
+    cursor.execute("""
+        INSERT INTO app_meta (meta_key, meta_value) VALUES ('roster_version', '1')
+        ON DUPLICATE KEY UPDATE meta_value = meta_value + 1
+    """)
+
+def get_meta(cursor, key):
+    cursor.execute("SELECT meta_value FROM app_meta WHERE meta_key = %s", (key,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def set_meta(cursor, key, value):
+    cursor.execute("""
+        INSERT INTO app_meta (meta_key, meta_value) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE meta_value = VALUES(meta_value)
+    """, (key, str(value)))
+
+# Recent logs and the archive of old closed ones (see Log retention); anything
+# that can reach back past the retention age reads both
+LOG_TABLES = ("logs", "logs_archive")
+
+def logs_union(select, where, params=()):
+    """`SELECT select ... WHERE where` over every log table as one UNION ALL, with its params"""
+    query = " UNION ALL ".join(f"SELECT {select} FROM {table} WHERE {where}" for table in LOG_TABLES)
+    return query, list(params) * len(LOG_TABLES)
+
+# ---------------------- Response cache ----------------------
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_LOCKS = 64
+
+class ResponseCache:
+    """Rendered JSON of the dashboard APIs, shared by every open Admin tab.
+
+    Each entry lives for its endpoint's TTL and carries the generation of the
+    data it was built from ('logs', 'roster'); invalidate() bumps a tag so the
+    next request rebuilds. Keys are request URLs, so any query string makes a
+    new one: expired entries are dropped on every put and past `max_entries`
+    the least recently used go. Concurrent misses of a key build once, under
+    one of a fixed set of locks picked by the key's hash.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._key_locks = [threading.Lock() for _ in range(RESPONSE_CACHE_LOCKS)]
+        self._lock = threading.Lock()
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def _stamp(self, tags):
+        return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def get(self, key, tags):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires"] > time.monotonic() and entry["stamp"] == self._stamp(tags):
+                self._entries.move_to_end(key)
+                return entry
+            return None
+
+    def put(self, key, tags, ttl, body, mimetype):
+        entry = {
+            "body": body,
+            "mimetype": mimetype,
+            "etag": hashlib.sha1(body).hexdigest()[:20],
+            "expires": time.monotonic() + ttl,
+        }
+        with self._lock:
+            entry["stamp"] = self._stamp(tags)
+            now = time.monotonic()
+            for old_key in [k for k, e in self._entries.items() if e["expires"] <= now]:
+                del self._entries[old_key]
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def key_lock(self, key):
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+response_cache = ResponseCache()
+
+def cached_api(ttl, tags=("logs",)):
+    """Serve a JSON view from response_cache, answering If-None-Match with 304"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.full_path
+            entry = response_cache.get(key, tags)
+            if entry is None:
+                with response_cache.key_lock(key):
+                    entry = response_cache.get(key, tags)
+                    if entry is None:
+                        response = make_response(view(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                        entry = response_cache.put(key, tags, ttl, response.get_data(), response.mimetype)
+
+            if entry["etag"] in request.if_none_match:
+                response = make_response("", 304)
+            else:
+                response = make_response(entry["body"])
+                response.mimetype = entry["mimetype"]
+            response.set_etag(entry["etag"])
+            # Browsers must revalidate, which is cheap: a 304 off the cache
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
+
+# ---------------------- Entry rollup ----------------------
+# Entry counts per (date, hour, role, branch, year). The analytics endpoints
+# read this instead of grouping the whole logs table on every refresh.
+# Past days are fixed once written; the catch-up job recomputes the days from
+# its watermark (and yesterday, for scans flushed late) up to today.
+ROLLUP_REFRESH_SECONDS = int(os.getenv("ROLLUP_REFRESH_SECONDS", "60"))
+ROLLUP_LOCK = f"{DB_CONFIG['database']}.job.entry_rollup"
+
+def ensure_rollup_table():
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS entry_rollup (
+                entry_date DATE NOT NULL,
+                hour TINYINT NOT NULL,
+                role VARCHAR(16) NOT NULL DEFAULT '',
+                branch VARCHAR(128) NOT NULL DEFAULT '',
+                year VARCHAR(16) NOT NULL DEFAULT '',
+                entries INT NOT NULL,
+                PRIMARY KEY (entry_date, hour, role, branch, year)
+            )
+        """)
+        cur.close()
+        conn.close()
+    except mysql.connector.Error as e:
+        print("Could not create entry_rollup table:", e)
+
+def refresh_rollup_days(cursor, start, end):
+    """Recompute the rollup rows for entry dates start..end (inclusive)"""
+    cursor.execute("DELETE FROM entry_rollup WHERE entry_date BETWEEN %s AND %s", (start, end))
+    union, params = logs_union("entry_date, entry_time, role, branch, year",
+                               "entry_date BETWEEN %s AND %s AND entry_time IS NOT NULL", (start, end))
+    cursor.execute(f"""
+        INSERT INTO entry_rollup (entry_date, hour, role, branch, year, entries)
+        SELECT entry_date, HOUR(entry_time), COALESCE(role, ''), COALESCE(branch, ''),
+               COALESCE(year, ''), COUNT(*)
+        FROM ({union}) AS l
+        GROUP BY entry_date, HOUR(entry_time), COALESCE(role, ''), COALESCE(branch, ''), COALESCE(year, '')
+    """, params)
+    return cursor.rowcount
+
+def rebuild_rollups(conn, start=None):
+    """Backfill the rollup from `start` (default: the first log) to today, a month per transaction"""
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute(" UNION ALL ".join(f"SELECT MIN(entry_date) AS first FROM {table}" for table in LOG_TABLES))
+        first = min((row[0] for row in cur.fetchall() if row[0] is not None), default=None)
+        cur.execute("SELECT CURDATE()")
+        today = cur.fetchone()[0]
+        start = start or first
+        buckets = 0
+        while start is not None and start <= today:
+            month_end = (start.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            end = min(month_end, today)
+            buckets += refresh_rollup_days(cur, start, end)
+            set_meta(cur, "entry_rollup_through", end)
+            conn.commit()
+            start = end + timedelta(days=1)
+        return buckets
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+def catch_up_rollups(full=False):
+    """Bring the rollup up to date; only one admin process does it at a time"""
+    conn = get_db_connection()
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute("SELECT GET_LOCK(%s, 0)", (ROLLUP_LOCK,))
+        if cur.fetchone()[0] != 1:
+            return 0
+        try:
+            through = None if full else get_meta(cur, "entry_rollup_through")
+            if through is None:
+                buckets = rebuild_rollups(conn)
+            else:
+                cur.execute("SELECT CURDATE()")
+                today = cur.fetchone()[0]
+                buckets = rebuild_rollups(conn, min(date.fromisoformat(through), today - timedelta(days=1)))
+            response_cache.invalidate("logs")
+            return buckets
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (ROLLUP_LOCK,))
+            cur.fetchall()
+    except mysql.connector.Error as e:
+        print("Rollup catch-up failed:", e)
+        return 0
+    finally:
+        cur.close()
+        conn.close()
+
+# ---------------------- Log retention ----------------------
+# Closed logs older than LOG_RETENTION_DAYS move to logs_archive (same columns
+# and indexes, migration 004) in batches of one transaction each. The hot
+# table keeps recent history and every open log, so the kiosk's per-scan
+# checks and the live queries stay on a small table; rollup rebuilds,
+# history, exports and analytics read both tables through logs_union().
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "365"))  # 0 = never archive
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "5000"))
+ARCHIVE_PAUSE_SECONDS = float(os.getenv("ARCHIVE_PAUSE_SECONDS", "0.2"))
+ARCHIVE_HOUR = int(os.getenv("ARCHIVE_HOUR", "2"))
+ARCHIVE_LOCK = f"{DB_CONFIG['database']}.job.archive_logs"
+
+def archive_logs():
+    """Move closed logs past the retention age into logs_archive; returns the rows moved"""
+    if LOG_RETENTION_DAYS <= 0:
+        return 0
+    conn = get_db_connection()
+    cur = conn.cursor(buffered=True)
+    moved = 0
+    try:
+        cur.execute("SELECT GET_LOCK(%s, 0)", (ARCHIVE_LOCK,))
+        if cur.fetchone()[0] != 1:
+            return 0
+        try:
+            cur.execute("SELECT CURDATE() - INTERVAL %s DAY, COALESCE(MAX(id), 0) FROM logs", (LOG_RETENTION_DAYS,))
+            cutoff, last_id = cur.fetchone()
+            # Generated columns (is_open, suffixes) are recomputed by the archive table
+            cur.execute("""
+                SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'logs' AND EXTRA NOT LIKE '%GENERATED%'
+                ORDER BY ORDINAL_POSITION
+            """)
+            columns = ", ".join(row[0] for row in cur.fetchall())
+
+            while True:
+                # The newest row always stays, so the id counter never falls
+                # back below archived ids (MySQL 5.7 recomputes it on restart)
+                cur.execute("""
+                    SELECT id FROM logs WHERE entry_date < %s AND is_open = 0 AND id < %s
+                    ORDER BY entry_date LIMIT %s
+                """, (cutoff, last_id, ARCHIVE_BATCH_ROWS))
+                ids = [row[0] for row in cur.fetchall()]
+                if not ids:
+                    break
+                marks = ", ".join(["%s"] * len(ids))
+                cur.execute(f"INSERT INTO logs_archive ({columns}) SELECT {columns} FROM logs WHERE id IN ({marks})", ids)
+                cur.execute(f"DELETE FROM logs WHERE id IN ({marks})", ids)
+                conn.commit()
+                moved += len(ids)
+                time.sleep(ARCHIVE_PAUSE_SECONDS)  # let the kiosk's writes through
+
+            set_meta(cur, "logs_archived_before", cutoff)
+            conn.commit()
+            if moved:
+                print(f"[ARCHIVE] Moved {moved} logs from before {cutoff} to logs_archive.")
+            return moved
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (ARCHIVE_LOCK,))
+            cur.fetchall()
+    except mysql.connector.Error as e:
+        conn.rollback()
+        print(f"Log archiving stopped after {moved} rows:", e)
+        return moved
+    finally:
+        cur.close()
+        conn.close()
+
+# ---------------------- Live event stream ----------------------
+# One change detector per process polls logs and fans entries, exits and
+# fresh live stats out to every open /api/stream through the broker.
+STREAM_POLL_SECONDS = float(os.getenv("STREAM_POLL_SECONDS", "2"))
+STREAM_HEARTBEAT_SECONDS = int(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+STREAM_BACKLOG = int(os.getenv("STREAM_BACKLOG", "500"))
+# Each open stream holds a server thread; keep this below serve.py --threads
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", "4"))
+
+class EventBroker:
+    """Recent events with increasing ids, so a reconnecting client
+    (Last-Event-ID) is sent exactly what it missed"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=STREAM_BACKLOG)
+        self.epoch = f"{os.getpid()}-{int(time.time())}"
+        self.last_id = 0
+        self.subscribers = 0
+
+    def publish(self, event, data):
+        with self._cond:
+            self.last_id += 1
+            self._events.append((self.last_id, event, data))
+            self._cond.notify_all()
+
+    def events_after(self, last_id):
+        """Events newer than `last_id`, or None when some were already dropped"""
+        with self._cond:
+            oldest = self._events[0][0] if self._events else self.last_id + 1
+            if last_id > self.last_id or last_id < oldest - 1:
+                return None
+            return [e for e in self._events if e[0] > last_id]
+
+    def wait(self, last_id, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.last_id != last_id, timeout)
+
+    def subscribe(self, delta):
+        with self._cond:
+            self.subscribers += delta
+
+broker = EventBroker()
+
+class ChangeDetector:
+    """Finds new entries (logs.id above the watermark) and exits (open logs
+    that have since closed) and publishes them. Idle while nobody listens."""
+
+    def __init__(self):
+        self.max_id = None
+        self.open_logs = {}
+
+    def poll(self):
+        if not broker.subscribers:
+            self.max_id = None
+            return
+        conn = get_db_connection()
+        cur = conn.cursor(dictionary=True)
+        try:
+            if self.max_id is None:
+                cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM logs")
+                self.max_id = cur.fetchone()["max_id"]
+                cur.execute("SELECT id, full_reg_no FROM logs WHERE is_open = 1")
+                self.open_logs = {row["id"]: row["full_reg_no"] for row in cur.fetchall()}
+                return
+
+            cur.execute("""
+                SELECT id, full_reg_no, name, branch, year, role, entry_date, entry_time, exit_time
+                FROM logs WHERE id > %s ORDER BY id
+            """, (self.max_id,))
+            new_rows = cur.fetchall()
+            cur.execute("SELECT id, full_reg_no FROM logs WHERE is_open = 1")
+            open_now = {row["id"]: row["full_reg_no"] for row in cur.fetchall()}
+
+            exited = [reg for log_id, reg in self.open_logs.items() if log_id not in open_now]
+            entered = [row for row in new_rows if row["id"] in open_now]
+            if new_rows:
+                self.max_id = new_rows[-1]["id"]
+            self.open_logs = open_now
+            if not (new_rows or exited):
+                return
+
+            for full_reg_no in exited:
+                broker.publish("exit", {"full_reg_no": str(full_reg_no)})
+            for row in entered:
+                broker.publish("entry", {
+                    "full_reg_no": str(row["full_reg_no"]),
+                    "name": row["name"],
+                    "branch": row["branch"],
+                    "year": row["year"],
+                    "role": row["role"],
+                    "entry_date": str(row["entry_date"]),
+                    "entry_time": format_clock(row["entry_time"]) if row["entry_time"] is not None else None
+                })
+            broker.publish("stats", query_live_stats(cur))
+            response_cache.invalidate("logs")
+        except mysql.connector.Error as e:
+            print("Change detector failed:", e)
+        finally:
+            cur.close()
+            conn.close()
+
+change_detector = ChangeDetector()
+
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Event"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+scheduler = BackgroundScheduler()
+
+def warm_up():
+    """Prepare this process before it accepts traffic; raises if the schema migrations cannot be applied"""
+    migrate.ensure_current(DB_CONFIG)
+    ensure_meta_table()
+    ensure_rollup_table()
+    ensure_import_jobs_table()
+    ensure_analytics_table()
+    ensure_query_stats_tables()
+    if not scheduler.running:
+        scheduler.add_job(catch_up_rollups, "interval", seconds=ROLLUP_REFRESH_SECONDS, id="entry_rollup",
+                          replace_existing=True, coalesce=True, max_instances=1,
+                          next_run_time=datetime.now())
+        scheduler.add_job(change_detector.poll, "interval", seconds=STREAM_POLL_SECONDS, id="change_detector",
+                          replace_existing=True, coalesce=True, max_instances=1)
+        scheduler.add_job(prebuild_exports, "cron", hour=EXPORT_PREBUILD_HOUR, id="export_prebuild",
+                          replace_existing=True, coalesce=True, max_instances=1)
+        scheduler.add_job(archive_logs, "cron", hour=ARCHIVE_HOUR, id="archive_logs",
+                          replace_existing=True, coalesce=True, max_instances=1)
+        scheduler.add_job(flush_query_stats, "interval", seconds=QUERY_STATS_FLUSH_SECONDS, id="query_stats",
+                          replace_existing=True, coalesce=True, max_instances=1)
+        scheduler.add_job(touch_import_jobs, "interval", seconds=IMPORT_HEARTBEAT_SECONDS, id="import_heartbeat",
+                          replace_existing=True, coalesce=True, max_instances=1)
+        scheduler.start()
+
+def shutdown():
+    """Finish background work before the worker exits"""
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    # Let queued and running imports complete
+    import_executor.shutdown(wait=True)
+    flush_query_stats()
 
 # Folder to save uploaded files temporarily
 UPLOAD_FOLDER = "uploads"
@@ -37,140 +510,452 @@ def index():
     return render_template("ind.html")
 
 # ---------------------- APIs ----------------------
+# How long dashboard responses are reused (seconds); charts follow the rollup refresh
+LIVE_CACHE_TTL = int(os.getenv("LIVE_CACHE_TTL", "10"))
+CHART_CACHE_TTL = int(os.getenv("CHART_CACHE_TTL", str(ROLLUP_REFRESH_SECONDS)))
 
-@app.route("/api/live_stats")
-def live_stats():
-    conn = get_db_connection()
-    cur = conn.cursor(dictionary=True)
-    
+
+def query_live_stats(cur):
     # Users currently inside
-    cur.execute("SELECT COUNT(*) AS inside FROM logs WHERE exit_time IS NULL")
+    cur.execute("SELECT COUNT(*) AS inside FROM logs WHERE is_open = 1")
     inside = cur.fetchone()["inside"]
 
     # Today's entries
     cur.execute("SELECT COUNT(*) AS today_entries FROM logs WHERE entry_date = CURDATE()")
     today_entries = cur.fetchone()["today_entries"]
+    return {"inside": inside, "today_entries": today_entries}
 
-    cur.close()
-    conn.close()
-    return jsonify({"inside": inside, "today_entries": today_entries})
+def format_clock(value):
+    """TIME column value (timedelta from MySQL, or a time) -> zero-padded 'HH:MM:SS'"""
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return value.strftime("%H:%M:%S")
 
-# ------------------- Active Users -------------------
-@app.route('/api/active_users', methods=['GET'])
-def active_users():
+def query_active_users(cur):
+    cur.execute("""
+        SELECT l.full_reg_no, l.name, l.branch, l.year, l.role, l.entry_time, f.email
+        FROM logs l
+        LEFT JOIN faculty f ON l.reg_suffix4 = f.full_reg_no
+        WHERE l.is_open = 1
+        ORDER BY l.entry_time DESC
+    """)
+    results = cur.fetchall()
+
+    # Times as zero-padded text, the same format as the kiosk's occupancy feed
+    for row in results:
+        if row.get("entry_time") is not None:
+            row["entry_time"] = format_clock(row["entry_time"])
+        if row.get("exit_time") is not None:
+            row["exit_time"] = format_clock(row["exit_time"])
+    return results
+
+def query_peak_hours_week(cur):
+    # Last 7 days (weekly)
+    cur.execute("""
+        SELECT hour, SUM(entries) AS entries
+        FROM entry_rollup
+        WHERE entry_date >= CURDATE() - INTERVAL 7 DAY
+        GROUP BY hour
+        ORDER BY hour
+    """)
+    # Format for Chart.js
+    return [{"hour": f"{r['hour']:02d}:00", "entries": int(r["entries"])} for r in cur.fetchall()]
+
+def query_daily_entries(cur):
+    cur.execute("""
+        SELECT entry_date, SUM(entries) AS entries
+        FROM entry_rollup
+        GROUP BY entry_date 
+        ORDER BY entry_date DESC LIMIT 7
+    """)
+    # Reverse for chronological order
+    return [{"date": str(r["entry_date"]), "entries": int(r["entries"])} for r in cur.fetchall()][::-1]
+
+def query_weekly_entries(cur):
+    cur.execute("""
+        SELECT YEARWEEK(entry_date) AS yearweek, SUM(entries) AS entries
+        FROM entry_rollup
+        GROUP BY yearweek 
+        ORDER BY yearweek DESC LIMIT 4
+    """)
+    return [{"week": str(r["yearweek"] % 100), "entries": int(r["entries"])} for r in cur.fetchall()][::-1]
+
+def query_monthly_entries(cur):
+    cur.execute("""
+        SELECT DATE_FORMAT(entry_date, '%Y-%m') AS month, SUM(entries) AS entries
+        FROM entry_rollup
+        GROUP BY month 
+        ORDER BY month DESC LIMIT 12
+    """)
+    return [{"month": r["month"], "entries": int(r["entries"])} for r in cur.fetchall()][::-1]
+
+def run_queries(*queries):
+    """Run query functions one after another on a single connection"""
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    cur = conn.cursor(dictionary=True)
     try:
-        query = """
-            SELECT l.full_reg_no, l.name, l.branch, l.year, l.role, l.entry_time, f.email
-            FROM logs l
-            LEFT JOIN faculty f ON RIGHT(l.full_reg_no, 4) = f.full_reg_no
-            WHERE l.exit_time IS NULL
-            ORDER BY l.entry_time DESC
-        """
-        cursor.execute(query)
-        results = cursor.fetchall()
+        return [query(cur) for query in queries]
+    finally:
+        cur.close()
+        conn.close()
+
 
-        # Convert datetime to string
-        for row in results:
-            if row.get("entry_time"):
-                row["entry_time"] = str(row["entry_time"])
-            if row.get("exit_time"):
-                row["exit_time"] = str(row["exit_time"])
+@app.route("/api/live_stats")
+@cached_api(LIVE_CACHE_TTL)
+def live_stats():
+    return jsonify(run_queries(query_live_stats)[0])
 
-        return jsonify(results)
+# ------------------- Active Users -------------------
+@app.route('/api/active_users', methods=['GET'])
+@cached_api(LIVE_CACHE_TTL, tags=("logs", "roster"))
+def active_users():
+    try:
+        return jsonify(run_queries(query_active_users)[0])
     except Exception as e:
         print("Error fetching active users:", e)
         return jsonify({"error": "Server error"}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
 
 
 @app.route("/api/peak_hours_week")
+@cached_api(CHART_CACHE_TTL)
 def peak_hours_week():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    # Last 7 days (weekly)
-    query = """
-        SELECT HOUR(entry_time) AS hour, COUNT(*) AS entries
-        FROM logs
-        WHERE entry_date >= CURDATE() - INTERVAL 7 DAY
-        GROUP BY HOUR(entry_time)
-        ORDER BY hour;
-    """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
-
-    # Format for Chart.js
-    data = []
-    for row in rows:
-        data.append({
-            "hour": f"{row['hour']:02d}:00",   # format 2-digit hour
-            "entries": row["entries"]
-        })
-
-    return jsonify(data)
+    return jsonify(run_queries(query_peak_hours_week)[0])
 
 # Daily, Weekly, Monthly entries APIs
 @app.route("/api/daily_entries")
+@cached_api(CHART_CACHE_TTL)
 def daily_entries():
-    conn = get_db_connection()
-    cur = conn.cursor(dictionary=True)
-    cur.execute("""
-        SELECT entry_date, COUNT(*) AS entries
-        FROM logs 
-        WHERE entry_date IS NOT NULL
-        GROUP BY entry_date 
-        ORDER BY entry_date DESC LIMIT 7
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    # rows are dicts with 'entry_date' and 'entries'. Reverse for chronological
-    out = [{"date": r["entry_date"].strftime("%Y-%m-%d") if isinstance(r["entry_date"], (datetime,)) else str(r["entry_date"]),
-            "entries": r["entries"]} for r in rows][::-1]
-    return jsonify(out)
+    return jsonify(run_queries(query_daily_entries)[0])
 
 
 @app.route("/api/weekly_entries")
+@cached_api(CHART_CACHE_TTL)
 def weekly_entries():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT WEEK(entry_date) AS week, COUNT(*) 
-        FROM logs 
-        WHERE entry_date IS NOT NULL
-        GROUP BY week 
-        ORDER BY week DESC LIMIT 4
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([{"week": str(r[0]), "entries": r[1]} for r in rows][::-1])
+    return jsonify(run_queries(query_weekly_entries)[0])
 
 @app.route("/api/monthly_entries")
+@cached_api(CHART_CACHE_TTL)
 def monthly_entries():
+    return jsonify(run_queries(query_monthly_entries)[0])
+
+# ------------------- Dashboard -------------------
+@app.route("/api/dashboard")
+@cached_api(LIVE_CACHE_TTL, tags=("logs", "roster"))
+def dashboard():
+    """Everything the dashboard shows, in one request and on one connection"""
+    try:
+        stats, users, peak, daily, weekly, monthly = run_queries(
+            query_live_stats, query_active_users, query_peak_hours_week,
+            query_daily_entries, query_weekly_entries, query_monthly_entries)
+    except mysql.connector.Error as e:
+        print("Error building dashboard:", e)
+        return jsonify({"error": "Server error"}), 500
+    return jsonify({
+        "live_stats": stats,
+        "active_users": users,
+        "peak_hours_week": peak,
+        "daily_entries": daily,
+        "weekly_entries": weekly,
+        "monthly_entries": monthly
+    })
+
+# ------------------- Stay & occupancy -------------------
+# Average stay, the occupancy curve of a day and its peak (analytics.py);
+# closed days are stored in day_analytics, so wide ranges stay cheap.
+ANALYTICS_MAX_DAYS = 366
+
+def ensure_analytics_table():
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        analytics.create_table(cur)
+        cur.close()
+        conn.close()
+    except mysql.connector.Error as e:
+        print("Could not create day_analytics table:", e)
+
+def analytics_days(start, end):
+    now = datetime.now()
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT DATE_FORMAT(entry_date, '%Y-%m') AS month, COUNT(*) 
-        FROM logs 
-        WHERE entry_date IS NOT NULL
-        GROUP BY month 
-        ORDER BY month DESC LIMIT 12
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return jsonify([{"month": r[0], "entries": r[1]} for r in rows][::-1])
+    try:
+        return analytics.days_analytics(conn, start, end, now.date(),
+                                        now.hour * 3600 + now.minute * 60 + now.second, LOG_TABLES)
+    finally:
+        conn.close()
+
+@app.route("/api/analytics/day")
+@cached_api(CHART_CACHE_TTL)
+def analytics_day():
+    """Stay figures and the occupancy curve of ?date= (default today)"""
+    try:
+        day = datetime.strptime(request.args.get("date") or date.today().isoformat(), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+    if day > date.today():
+        return jsonify({"error": "date must not be in the future"}), 400
+    return jsonify(analytics_days(day, day)[0])
+
+@app.route("/api/analytics/days")
+@cached_api(CHART_CACHE_TTL)
+def analytics_range():
+    """Per-day stay and peak figures for ?start=..?end= (default the last 30 days), without the curves"""
+    try:
+        end = datetime.strptime(request.args.get("end") or date.today().isoformat(), "%Y-%m-%d").date()
+        start = (datetime.strptime(request.args["start"], "%Y-%m-%d").date() if request.args.get("start")
+                 else end - timedelta(days=29))
+    except ValueError:
+        return jsonify({"error": "Dates must be in YYYY-MM-DD format."}), 400
+    end = min(end, date.today())
+    if start > end:
+        return jsonify({"error": "start date must be <= end date"}), 400
+    if (end - start).days >= ANALYTICS_MAX_DAYS:
+        return jsonify({"error": f"At most {ANALYTICS_MAX_DAYS} days at a time."}), 400
+
+    try:
+        days = analytics_days(start, end)
+    except mysql.connector.Error as e:
+        print("Error computing analytics:", e)
+        return jsonify({"error": "Server error"}), 500
+
+    for day in days:
+        del day["occupancy"]
+    # Stays averaged over every closed visit of the range, not over days
+    weighted = [(day["average_stay_seconds"], day["visits"] - day["open_visits"])
+                for day in days if day["average_stay_seconds"] is not None]
+    closed = sum(n for _, n in weighted)
+    busiest = max(days, key=lambda day: day["peak_occupancy"], default=None)
+    return jsonify({
+        "days": days,
+        "average_stay_seconds": round(sum(avg * n for avg, n in weighted) / closed, 1) if closed else None,
+        "peak": busiest if busiest and busiest["peak_occupancy"] else None,
+    })
+
+# ------------------- Query stats -------------------
+# Per-template statement timings of both apps (query_profiler.py), flushed by
+# every worker to query_stats / slow_queries. ?days= is the window; each
+# template is compared with the window before it, so a query that got
+# slower shows up with its old and new average next to its EXPLAIN.
+# Statements and samples are internals, so the endpoint is off until
+# ADMIN_API_TOKEN is set and then needs it in an X-Admin-Token header:
+#     curl -H "X-Admin-Token: $ADMIN_API_TOKEN" localhost:5001/api/query_stats
+QUERY_STATS_FLUSH_SECONDS = int(os.getenv("QUERY_STATS_FLUSH_SECONDS", "60"))
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+QUERY_STATS_SORTS = {
+    "total": "total_ms",
+    "avg": "total_ms / calls",
+    "max": "max_ms",
+    "calls": "calls",
+    "slow": "slow_calls",
+}
+
+def ensure_query_stats_tables():
+    try:
+        conn = mysql.connector.connect(**DB_CONFIG)
+        cur = conn.cursor()
+        profiler.ensure_tables(cur)
+        cur.close()
+        conn.close()
+    except mysql.connector.Error as e:
+        print("Could not create query stats tables:", e)
+
+def flush_query_stats():
+    try:
+        conn = mysql.connector.connect(**DB_CONFIG)
+    except mysql.connector.Error as e:
+        print("Could not store query stats:", e)
+        return 0
+    try:
+        return profiler.flush(conn)
+    finally:
+        conn.close()
+
+def require_admin_token(view):
+    """Answer 403 unless the request carries ADMIN_API_TOKEN (always, while it is unset)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_API_TOKEN:
+            return jsonify({"error": "Disabled: set ADMIN_API_TOKEN to enable it."}), 403
+        token = request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(token.encode("utf-8"), ADMIN_API_TOKEN.encode("utf-8")):
+            return jsonify({"error": "Missing or wrong X-Admin-Token."}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route("/api/query_stats")
+@require_admin_token
+def query_stats():
+    """Slowest query templates of the last ?days= (default 7), with recent slow samples and their plans"""
+    try:
+        days = min(max(int(request.args.get("days", "7")), 1), 90)
+        limit = min(max(int(request.args.get("limit", "50")), 1), 500)
+    except ValueError:
+        return jsonify({"error": "days and limit must be numbers"}), 400
+    sort = request.args.get("sort", "total")
+    if sort not in QUERY_STATS_SORTS:
+        return jsonify({"error": f"sort must be one of: {', '.join(QUERY_STATS_SORTS)}"}), 400
+    app_name = request.args.get("app")
+
+    # This worker's latest numbers first; the others flush on their own schedule
+    flush_query_stats()
+    since = date.today() - timedelta(days=days - 1)
+    params = {"since": since, "before": since - timedelta(days=days), "limit": limit,
+              "app": app_name, "template": request.args.get("template")}
+
+    conn = get_db_connection()
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(f"""
+            SELECT app, route, template_hash, MAX(template) AS template,
+                   SUM(IF(stat_date >= %(since)s, calls, 0)) AS calls,
+                   SUM(IF(stat_date >= %(since)s, total_ms, 0)) AS total_ms,
+                   MAX(IF(stat_date >= %(since)s, max_ms, 0)) AS max_ms,
+                   SUM(IF(stat_date >= %(since)s, rows_total, 0)) AS rows_total,
+                   SUM(IF(stat_date >= %(since)s, errors, 0)) AS errors,
+                   SUM(IF(stat_date >= %(since)s, slow_calls, 0)) AS slow_calls,
+                   SUM(IF(stat_date < %(since)s, calls, 0)) AS previous_calls,
+                   SUM(IF(stat_date < %(since)s, total_ms, 0)) AS previous_total_ms
+            FROM query_stats
+            WHERE stat_date >= %(before)s {"AND app = %(app)s" if app_name else ""}
+            GROUP BY app, route, template_hash
+            HAVING calls > 0
+            ORDER BY {QUERY_STATS_SORTS[sort]} DESC
+            LIMIT %(limit)s
+        """, params)
+        templates = cur.fetchall()
+
+        cur.execute(f"""
+            SELECT captured_at, app, route, template_hash, statement, params, duration_ms, rows_count, plan
+            FROM slow_queries
+            WHERE captured_at >= %(since)s {"AND app = %(app)s" if app_name else ""}
+                  {"AND template_hash = %(template)s" if params["template"] else ""}
+            ORDER BY duration_ms DESC
+            LIMIT 20
+        """, params)
+        slow = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+    for row in templates:
+        calls, previous = int(row.pop("calls")), int(row.pop("previous_calls"))
+        total, previous_total = float(row.pop("total_ms")), float(row.pop("previous_total_ms"))
+        row.update(
+            calls=calls,
+            total_ms=round(total, 1),
+            avg_ms=round(total / calls, 2),
+            max_ms=round(float(row["max_ms"]), 1),
+            rows_per_call=round(int(row.pop("rows_total")) / calls, 1),
+            errors=int(row["errors"]),
+            slow_calls=int(row["slow_calls"]),
+            previous_avg_ms=round(previous_total / previous, 2) if previous else None,
+        )
+    for row in slow:
+        row["captured_at"] = str(row["captured_at"])
+        row["plan"] = json.loads(row["plan"]) if row["plan"] else None
+
+    return jsonify({"days": days, "since": since.isoformat(), "templates": templates, "slow": slow})
+
+# ------------------- Live Stream -------------------
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CLIENTS)
+
+@app.route("/api/stream")
+def stream():
+    """Server-Sent Events: entry, exit and stats as the change detector sees them.
+
+    A client whose Last-Event-ID is unknown (first connect, restarted
+    worker, or too far behind) gets a "reset" and reloads the dashboard.
+    """
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({"error": "Too many live streams"}), 503
+    broker.subscribe(1)
+
+    def release():
+        broker.subscribe(-1)
+        stream_slots.release()
+
+    epoch, _, last = (request.headers.get("Last-Event-ID") or "").rpartition(":")
+    last_id = int(last) if epoch == broker.epoch and last.isdigit() else None
+
+    def generate(last_id):
+        yield "retry: 3000\n\n"
+        while True:
+            events = broker.events_after(last_id) if last_id is not None else None
+            if events is None:
+                last_id = broker.last_id
+                yield sse_event("reset", {}, f"{broker.epoch}:{last_id}")
+                continue
+            for event_id, event, data in events:
+                yield sse_event(event, data, f"{broker.epoch}:{event_id}")
+                last_id = event_id
+            if not broker.wait(last_id, STREAM_HEARTBEAT_SECONDS):
+                yield ": heartbeat\n\n"
+
+    response = Response(generate(last_id), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(release)
+    return response
+
+# ------------------- User history -------------------
+# Newest first, one page at a time: ?limit= rows after the ?after= cursor
+# handed out with the previous page (keyset on entry_date, entry_time, id),
+# optionally within ?start= / ?end= and reduced to the ?fields= asked for.
+# ?summary=1 adds visit totals that MySQL computes over the whole
+# (filtered) history, so the browser never needs every row.
+HISTORY_FIELDS = ["entry_date", "entry_time", "exit_date", "exit_time",
+                  "full_reg_no", "name", "branch", "year", "email", "role"]
+HISTORY_TEXT_FIELDS = {"entry_date", "entry_time", "exit_date", "exit_time"}
+HISTORY_PAGE_ROWS = 50
+HISTORY_MAX_ROWS = 500
+
+# A user's logs: students match on the last 5 digits, faculty on the last 4
+HISTORY_MATCHES = ["reg_suffix5 = %s AND role = 'Student'", "reg_suffix4 = %s AND role = 'Faculty'"]
+
+def parse_history_cursor(value):
+    """'YYYY-MM-DD|H:MM:SS|id' -> params of the keyset condition, or None if malformed"""
+    try:
+        day, at, log_id = value.split("|")
+        datetime.strptime(day, "%Y-%m-%d")
+        hours, minutes, seconds = (int(part) for part in at.split(":"))
+        if not (0 <= minutes < 60 and 0 <= seconds < 60 and hours >= 0):
+            return None
+        log_id = int(log_id)
+    except ValueError:
+        return None
+    return (day, day, at, at, log_id)
+
+def history_union(reg_no, select, conditions, params, tail=""):
+    """The student and faculty parts of a user's history, hot and archived, as one UNION ALL"""
+    halves = []
+    union_params = []
+    for table in LOG_TABLES:
+        for match in HISTORY_MATCHES:
+            where = " AND ".join([match] + conditions)
+            halves.append(f"(SELECT {select} FROM {table} WHERE {where} {tail})")
+            union_params += [reg_no] + params
+    return " UNION ALL ".join(halves), union_params
+
+def query_history_summary(cursor, reg_no, conditions, params):
+    union, union_params = history_union(reg_no, """
+        TIMESTAMP(entry_date, entry_time) AS arrived,
+        CASE WHEN is_open = 0
+             THEN TIMESTAMPDIFF(SECOND, TIMESTAMP(entry_date, entry_time), TIMESTAMP(exit_date, exit_time))
+        END AS stay""", conditions, params)
+    cursor.execute(f"""
+        SELECT COUNT(*) AS visits, SUM(stay) AS total_seconds, AVG(stay) AS average_seconds,
+               MIN(arrived) AS first_visit, MAX(arrived) AS last_visit
+        FROM ({union}) AS visits
+    """, union_params)
+    row = cursor.fetchone()
+    return {
+        "visits": row["visits"],
+        "total_seconds": int(row["total_seconds"] or 0),
+        "average_seconds": round(float(row["average_seconds"]), 1) if row["average_seconds"] is not None else None,
+        "first_visit": str(row["first_visit"]) if row["first_visit"] else None,
+        "last_visit": str(row["last_visit"]) if row["last_visit"] else None,
+    }
 
-# User history by reg_no 
 @app.route('/api/user_history/<reg_no>', methods=['GET'])
 def user_history(reg_no):
     reg_no = reg_no.strip()
@@ -178,30 +963,218 @@ def user_history(reg_no):
     if not reg_no.isdigit():
         return jsonify({"error": "Invalid registration number"}), 400
 
+    try:
+        limit = min(max(int(request.args.get("limit", HISTORY_PAGE_ROWS)), 1), HISTORY_MAX_ROWS)
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+
+    fields = [f.strip() for f in request.args.get("fields", ",".join(HISTORY_FIELDS)).split(",") if f.strip()]
+    unknown = sorted(set(fields) - set(HISTORY_FIELDS))
+    if unknown or not fields:
+        return jsonify({"error": f"fields must be some of: {', '.join(HISTORY_FIELDS)}"}), 400
+
+    conditions, params = [], []
+    for arg, op in (("start", ">="), ("end", "<=")):
+        value = request.args.get(arg)
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                return jsonify({"error": "Dates must be in YYYY-MM-DD format."}), 400
+            conditions.append(f"entry_date {op} %s")
+            params.append(value)
+
+    page_conditions, page_params = list(conditions), list(params)
+    if request.args.get("after"):
+        keyset = parse_history_cursor(request.args["after"])
+        if keyset is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        page_conditions.append(
+            "(entry_date < %s OR (entry_date = %s AND (entry_time < %s OR (entry_time = %s AND id < %s))))")
+        page_params += list(keyset)
+
+    # Dates and times leave MySQL as text; the raw sort keys only build the cursor
+    select = ", ".join(["id", "entry_date AS sort_date", "entry_time AS sort_time"] +
+                       [f"CAST({f} AS CHAR) AS {f}" if f in HISTORY_TEXT_FIELDS else f for f in fields])
+    # Each half reads at most one page off its suffix index, newest first
+    union, union_params = history_union(reg_no, select, page_conditions, page_params,
+                                        f"ORDER BY entry_date DESC, entry_time DESC, id DESC LIMIT {limit + 1}")
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"{union} ORDER BY sort_date DESC, sort_time DESC, id DESC LIMIT {limit + 1}", union_params)
+        rows = cursor.fetchall()
+        summary = None
+        if request.args.get("summary") in ("1", "true"):
+            summary = query_history_summary(cursor, reg_no, conditions, params)
+    finally:
+        cursor.close()
+        conn.close()
 
-    query = """
-        SELECT *
-        FROM logs
-        WHERE (role='Student' AND RIGHT(full_reg_no, 5) = %s)
-           OR (role='Faculty' AND RIGHT(full_reg_no, 4) = %s)
-        ORDER BY entry_date DESC, entry_time DESC
-    """
-    cursor.execute(query, (reg_no, reg_no))
-    results = cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last['sort_date']}|{last['sort_time']}|{last['id']}"
+    for row in rows:
+        del row["id"], row["sort_date"], row["sort_time"]
+
+    result = {"rows": rows, "next": next_cursor}
+    if summary is not None:
+        result["summary"] = summary
+    return jsonify(result)
+
+
+# ------------------- Log exports -------------------
+# Rows are read from an unbuffered cursor a chunk at a time and handed to a
+# format writer, so memory stays flat however long the date range is.
+# CSV and gzip CSV are produced as the rows arrive; xlsx and Parquet are
+# written to a temporary file first (both need a footer/directory at the
+# end) and then streamed out.
+EXPORT_COLUMNS = ["full_reg_no", "name", "branch", "year", "email",
+                  "entry_date", "entry_time", "exit_date", "exit_time", "role"]
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "2000"))
+EXPORT_SEND_BYTES = 64 * 1024
+
+def iter_log_chunks(where, params, order):
+    """Yield lists of export rows (tuples in EXPORT_COLUMNS order)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        union, union_params = logs_union(", ".join(EXPORT_COLUMNS), where, params)
+        cursor.execute(f"{union} ORDER BY {order}", union_params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+            if not rows:
+                break
+            yield rows
+    finally:
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            # Stopped early (client went away) with rows still unread
+            pass
+        finally:
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
 
-    # Convert dates/times to strings
-    for row in results:
-        for key in ['entry_date', 'exit_date', 'entry_time', 'exit_time']:
-            if row[key]:
-                row[key] = str(row[key])
+def export_cell(value):
+    # Dates and times go out as text, like the old DataFrame export
+    return str(value) if isinstance(value, (date, timedelta)) else value
 
-    cursor.close()
-    conn.close()
-    return jsonify(results)
+def stream_file(path):
+    """Yield a finished export file in pieces, deleting it afterwards"""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(EXPORT_SEND_BYTES)
+                if not data:
+                    break
+                yield data
+    finally:
+        os.remove(path)
+
+def temp_export_path(suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+def stream_xlsx(chunks, sheet_name):
+    """Write the row chunks to a constant-memory workbook, then yield its bytes"""
+    import xlsxwriter
 
+    path = temp_export_path(".xlsx")
+    try:
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        sheet = workbook.add_worksheet(sheet_name)
+        sheet.write_row(0, 0, EXPORT_COLUMNS)
+        row_num = 1
+        for rows in chunks:
+            for row in rows:
+                sheet.write_row(row_num, 0, [export_cell(value) for value in row])
+                row_num += 1
+        workbook.close()
+    except BaseException:
+        os.remove(path)
+        raise
+    yield from stream_file(path)
+
+def iter_csv(chunks):
+    """CSV text, one piece per row chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows([export_cell(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+def stream_csv_gz(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for data in iter_csv(chunks):
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def stream_parquet(chunks):
+    """One Parquet row group per chunk, all columns as text like the other formats"""
+    schema = pyarrow.schema([(column, pyarrow.string()) for column in EXPORT_COLUMNS])
+    path = temp_export_path(".parquet")
+    try:
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for rows in chunks:
+                columns = [[None if value is None else str(value) for value in column] for column in zip(*rows)]
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(values, pyarrow.string()) for values in columns], schema=schema))
+    except BaseException:
+        os.remove(path)
+        raise
+    yield from stream_file(path)
+
+# format -> (file extension, mimetype, writer(chunks, sheet_name))
+EXPORT_FORMATS = {
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", stream_xlsx),
+    "csv": (".csv", "text/csv", lambda chunks, sheet_name: iter_csv(chunks)),
+    "csv.gz": (".csv.gz", "application/gzip", lambda chunks, sheet_name: stream_csv_gz(chunks)),
+    "parquet": (".parquet", "application/vnd.apache.parquet", lambda chunks, sheet_name: stream_parquet(chunks)),
+}
 
+def export_logs(where, params, order, filename, sheet_name, empty_message, cache_name=None):
+    """Send the matching logs in the ?format= asked for.
+
+    With a cache_name the export is final: it is built once into the export
+    artifact cache and served from there.
+    """
+    fmt = request.args.get("format", "xlsx").lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown format. Use one of: {', '.join(EXPORT_FORMATS)}."}), 400
+    if fmt == "parquet" and pyarrow is None:
+        return jsonify({"error": "Parquet export needs the pyarrow package installed on the server."}), 400
+    extension, mimetype, writer = EXPORT_FORMATS[fmt]
+
+    if cache_name:
+        path = log_export_artifact(cache_name, fmt, where, params, order, sheet_name)
+        if path is None:
+            return jsonify({"error": empty_message}), 404
+        return send_file(path, mimetype=mimetype, as_attachment=True, download_name=filename + extension)
+
+    chunks = iter_log_chunks(where, params, order)
+    first = next(chunks, None)
+    if first is None:
+        return jsonify({"error": empty_message}), 404
+
+    rest = chunks
+    chunks = itertools.chain([first], rest)
+    response = Response(writer(chunks, sheet_name), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}{extension}"'
+    # Make sure the cursor is released even if the download never starts
+    response.call_on_close(rest.close)
+    return response
 
 
 @app.route('/export/daily', methods=['GET'])
@@ -209,47 +1182,14 @@ def export_daily_logs():
     date_str = request.args.get('date') or date.today().strftime("%Y-%m-%d")
 
     try:
-        datetime.strptime(date_str, "%Y-%m-%d")
+        day = datetime.strptime(date_str, "%Y-%m-%d").date()
     except Exception:
         return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    query = """
-        SELECT full_reg_no, name, branch, year, email, entry_date, entry_time, exit_date, exit_time, role
-        FROM logs
-        WHERE entry_date = %s
-        ORDER BY entry_time DESC
-    """
-    cursor.execute(query, (date_str,))
-    rows = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
-
-    if not rows:
-        return jsonify({"error": f"No logs found for {date_str}"}), 404
-
-    # Convert datetime/time to string
-    for r in rows:
-        for key in ['entry_date', 'entry_time', 'exit_date', 'exit_time']:
-            if r.get(key):
-                r[key] = str(r[key])
-
-    df = pd.DataFrame(rows)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Daily Logs')
-    output.seek(0)
-
-    filename = f"daily_logs_{date_str}.xlsx"
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    # Today's report still grows; earlier days come from the artifact cache
+    cache_name = daily_export_name(day) if day < date.today() else None
+    return export_logs(*daily_export_query(day), f"daily_logs_{date_str}", "Daily Logs",
+                       f"No logs found for {date_str}", cache_name=cache_name)
 
 
 @app.route('/export/range', methods=['GET'])
@@ -269,183 +1209,619 @@ def export_range_logs():
     if s > e:
         return jsonify({"error": "start date must be <= end date"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    query = """
-        SELECT full_reg_no, name, branch, year, email, entry_date, entry_time, exit_date, exit_time, role
-        FROM logs
-        WHERE entry_date BETWEEN %s AND %s
-        ORDER BY entry_date DESC, entry_time DESC
+    return export_logs("entry_date BETWEEN %s AND %s", (start_date, end_date), "entry_date DESC, entry_time DESC",
+                       f"logs_{start_date}_to_{end_date}", "Logs",
+                       f"No logs found between {start_date} and {end_date}")
+
+
+# ------------------- Export artifact cache -------------------
+# Exports that can no longer change are built once into EXPORT_CACHE_DIR and
+# then served as plain files; send_file adds Last-Modified and an ETag and
+# answers conditional and range requests. Roster workbooks are named after
+# the roster version, past-day reports after the day and a fingerprint of
+# its logs (so an exit recorded after midnight still makes a new file).
+# The least recently served files go once the folder passes its size limit.
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", "export_cache")
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_MB", "512")) * 1024 * 1024
+EXPORT_PREBUILD_HOUR = int(os.getenv("EXPORT_PREBUILD_HOUR", "1"))
+EXPORT_PREBUILD_FORMATS = os.getenv("EXPORT_PREBUILD_FORMATS", "xlsx").split(",")
+EXPORT_PREBUILD_LOCK = f"{DB_CONFIG['database']}.job.export_prebuild"
+os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+
+class ExportArtifactCache:
+    """Finished export files on disk, looked up by name.
+
+    A file is built under a temporary name and renamed into place, so other
+    workers never see half a file. Serving a file marks it as used (its
+    access time); evict() removes the least recently used files first.
     """
-    cursor.execute(query, (start_date, end_date))
-    rows = cursor.fetchall()
 
-    cursor.close()
-    conn.close()
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._key_locks = {}
+        self._lock = threading.Lock()
 
-    if not rows:
-        return jsonify({"error": f"No logs found between {start_date} and {end_date}"}), 404
+    def _key_lock(self, name):
+        with self._lock:
+            return self._key_locks.setdefault(name, threading.Lock())
 
-    for r in rows:
-        for key in ['entry_date', 'entry_time', 'exit_date', 'exit_time']:
-            if r.get(key):
-                r[key] = str(r[key])
+    def _touch(self, path):
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+            return True
+        except FileNotFoundError:
+            return False
 
-    df = pd.DataFrame(rows)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Logs')
-    output.seek(0)
+    def get_or_build(self, name, build):
+        """Path of artifact `name`, running build(path) first if it is missing.
 
-    filename = f"logs_{start_date}_to_{end_date}.xlsx"
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+        build returns False when there is nothing to export; then no file is
+        kept and None is returned.
+        """
+        path = os.path.join(self.folder, name)
+        if self._touch(path):
+            return path
+        with self._key_lock(name):
+            if self._touch(path):
+                return path
+            # Leading dot: evict() leaves files that are still being written alone
+            partial = os.path.join(self.folder, f".{uuid.uuid4().hex}.{name}")
+            try:
+                if build(partial) is False:
+                    return None
+                os.replace(partial, path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+        self.evict(keep=path)
+        return path
+
+    def discard(self, prefix, keep=None):
+        """Remove the artifacts whose name starts with `prefix` (e.g. old roster versions)"""
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith(prefix) and entry.path != keep:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    # Already gone, or (Windows) still being sent; the next call retries it
+                    pass
+
+    def evict(self, keep=None):
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and not entry.name.startswith("."):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_atime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Windows will not remove a file that is still being sent; the
+                # next evict() retries it, and it still counts towards the total
+                continue
+            total -= size
 
+export_artifacts = ExportArtifactCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES)
 
-# ------------------- Import Students -------------------
-@app.route("/import/students", methods=["POST"])
-def import_students():
-    if "file" not in request.files:
-        return jsonify({"error": "No file uploaded"}), 400
+def write_log_export(path, writer, where, params, order, sheet_name):
+    """Write a log export to `path`; False if no rows match"""
+    chunks = iter_log_chunks(where, params, order)
+    try:
+        first = next(chunks, None)
+        if first is None:
+            return False
+        with open(path, "wb") as f:
+            for data in writer(itertools.chain([first], chunks), sheet_name):
+                f.write(data)
+    finally:
+        chunks.close()
 
-    file = request.files["file"]
-    if file.filename == "":
-        return jsonify({"error": "Empty filename"}), 400
+def log_export_artifact(name, fmt, where, params, order, sheet_name):
+    """Path of a cached log export in `fmt`; None if no rows match"""
+    extension, _, writer = EXPORT_FORMATS[fmt]
+    return export_artifacts.get_or_build(
+        name + extension, lambda path: write_log_export(path, writer, where, params, order, sheet_name))
+
+def daily_export_query(day):
+    # where, params, order of the report of one day
+    return "entry_date = %s", (day.isoformat(),), "entry_time DESC"
+
+def daily_export_name(day):
+    """Cache name of a day's report: changes whenever a log of that day is added or closed"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # Over both tables, so archiving a day's logs keeps its cached report
+        union, params = logs_union("id, is_open", "entry_date = %s", (day.isoformat(),))
+        cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(is_open), 0), COALESCE(MAX(id), 0) FROM ({union}) AS day_logs",
+                       params)
+        count, still_open, last_id = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+    return f"daily_logs_{day.isoformat()}_{count}_{still_open}_{last_id}"
 
+def prebuild_exports():
+    """Nightly: build yesterday's report so the morning downloads are plain file reads"""
+    conn = get_db_connection()
+    cur = conn.cursor(buffered=True)
     try:
-        df = pd.read_excel(file, dtype=str)   # force everything to string
-        df = df.where(pd.notnull(df), None)   # replace NaN with None
+        cur.execute("SELECT GET_LOCK(%s, 0)", (EXPORT_PREBUILD_LOCK,))
+        if cur.fetchone()[0] != 1:
+            return
+        try:
+            day = date.today() - timedelta(days=1)
+            name = daily_export_name(day)
+            for fmt in EXPORT_PREBUILD_FORMATS:
+                if fmt == "parquet" and pyarrow is None:
+                    continue
+                log_export_artifact(name, fmt, *daily_export_query(day), "Daily Logs")
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (EXPORT_PREBUILD_LOCK,))
+            cur.fetchall()
+    except (mysql.connector.Error, OSError) as e:
+        print("Export prebuild failed:", e)
+    finally:
+        cur.close()
+        conn.close()
 
+def roster_export(table, columns, sheet_name, download_name):
+    """Send the roster workbook of the current roster version, building it once"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        version = get_meta(cursor, "roster_version") or "0"
+    finally:
+        cursor.close()
+        conn.close()
+
+    def build(path):
         conn = get_db_connection()
         cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            wb = openpyxl.Workbook(write_only=True)
+            ws = wb.create_sheet(sheet_name)
+            ws.append(columns)
+            for row in cursor:
+                ws.append(row)
+            wb.save(path)
+        finally:
+            cursor.close()
+            conn.close()
+
+    name = f"{table}_v{version}.xlsx"
+    path = export_artifacts.get_or_build(name, build)
+    export_artifacts.discard(f"{table}_v", keep=path)
+    return send_file(path, as_attachment=True, download_name=download_name,
+                     mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+
+# ------------------- Roster imports -------------------
+# The workbook is read row by row (openpyxl read-only mode) and upserted in
+# multi-row batches. Rows that fail validation or the database are reported
+# back instead of being skipped silently.
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_REPORT_ERRORS = 100   # rejected rows listed in the report
+
+# table -> (columns, with full_reg_no first; required columns)
+ROSTER_IMPORTS = {
+    "students": (["full_reg_no", "name", "branch", "year"], {"full_reg_no", "name"}),
+    "faculty": (["full_reg_no", "name", "email"], {"full_reg_no", "name"}),
+}
 
-        for _, row in df.iterrows():
+def cell_text(value):
+    """Excel cell as trimmed text (what read_excel(dtype=str) used to give)"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+def read_roster_rows(file, columns, required):
+    """Yield (sheet row number, values in `columns` order) from the first sheet"""
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [cell_text(name) for name in next(rows, ())]
+        missing = sorted(required - set(header))
+        if missing:
+            raise ValueError(f"Missing column(s): {', '.join(missing)}")
+        positions = [header.index(column) if column in header else None for column in columns]
+        for number, row in enumerate(rows, start=2):
+            values = [cell_text(row[i]) if i is not None and i < len(row) else None for i in positions]
+            if any(values):
+                yield number, values
+    finally:
+        workbook.close()
+
+def reject_row(report, number, full_reg_no, reason):
+    report["rejected"] += 1
+    if len(report["errors"]) < IMPORT_REPORT_ERRORS:
+        report["errors"].append({"row": number, "full_reg_no": full_reg_no, "reason": reason})
+
+def upsert_roster_batch(cursor, table, columns, batch, report):
+    """Upsert one batch of validated rows, counting inserts and updates"""
+    keys = list({values[0] for _, values in batch})
+    cursor.execute(f"SELECT full_reg_no FROM {table} WHERE full_reg_no IN ({', '.join(['%s'] * len(keys))})", keys)
+    existing = {str(row[0]) for row in cursor.fetchall()}
+
+    query = f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        ON DUPLICATE KEY UPDATE {', '.join(f"{c} = VALUES({c})" for c in columns[1:])}
+    """
+    try:
+        cursor.executemany(query, [values for _, values in batch])
+    except mysql.connector.Error:
+        # Redo the batch row by row to find out which rows the database refuses
+        for number, values in batch:
             try:
-                cursor.execute("""
-                    INSERT INTO students (full_reg_no, name, branch, year)
-                    VALUES (%s, %s, %s, %s)
-                    ON DUPLICATE KEY UPDATE 
-                        name = VALUES(name),
-                        branch = VALUES(branch),
-                        year = VALUES(year)
-                """, (
-                    row.get("full_reg_no"),
-                    row.get("name"),
-                    row.get("branch"),
-                    row.get("year")
-                ))
-            except Exception as e:
-                print(f"Skipping row due to error: {e}")
+                cursor.execute(query, values)
+            except mysql.connector.Error as e:
+                reject_row(report, number, values[0], e.msg)
+                continue
+            # 1 = inserted, 2 = changed, 0 = identical existing row
+            report["inserted" if cursor.rowcount == 1 else "updated"] += 1
+        return
+
+    for _, values in batch:
+        report["updated" if values[0] in existing else "inserted"] += 1
+        existing.add(values[0])
+
+def roster_row_hash(values):
+    """Content hash of a roster row, key excluded"""
+    return hashlib.md5("\x1f".join(value or "" for value in values[1:]).encode("utf-8")).hexdigest()
+
+def load_roster_hashes(cursor, table, columns):
+    cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    return {cell_text(row[0]): roster_row_hash([cell_text(value) for value in row]) for row in cursor.fetchall()}
+
+def delete_roster_rows(cursor, table, keys):
+    for i in range(0, len(keys), IMPORT_BATCH_SIZE):
+        chunk = keys[i:i + IMPORT_BATCH_SIZE]
+        cursor.execute(f"DELETE FROM {table} WHERE full_reg_no IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+def list_sample(report, name, key):
+    if len(report[name]) < IMPORT_REPORT_ERRORS:
+        report[name].append(key)
+
+def import_roster(file, table, progress=None, mode="diff", dry_run=False, delete_missing=False):
+    """Import a roster workbook into `table`; returns the import report.
+
+    mode "upsert" writes every row. mode "diff" hashes each row against the
+    current roster and writes only new or changed ones; with delete_missing
+    it also removes roster rows absent from the file. dry_run computes the
+    report (adds, changes, removals) without writing anything.
+    `progress(report)` is called every IMPORT_BATCH_SIZE rows.
+    """
+    columns, required = ROSTER_IMPORTS[table]
+    diff = mode == "diff"
+    report = {"mode": mode, "dry_run": dry_run, "processed": 0, "inserted": 0, "updated": 0,
+              "unchanged": 0, "deleted": 0, "rejected": 0, "errors": []}
+    if diff:
+        report.update(adds=[], changes=[], removals=[])
+    conn = get_db_connection()
+    cursor = conn.cursor(buffered=True)
+    try:
+        current = load_roster_hashes(cursor, table, columns) if diff else {}
+        seen = set()
+        batch = []
+        for number, values in read_roster_rows(file, columns, required):
+            report["processed"] += 1
+            if progress and report["processed"] % IMPORT_BATCH_SIZE == 0:
+                progress(report)
+
+            if table == "faculty" and values[0] and values[0].isdigit():
+                values[0] = str(int(values[0]))
+            if diff and values[0]:
+                # Seen even if the row is rejected below: a bad row must not delete its entry
+                seen.add(values[0])
+
+            blank = [column for column, value in zip(columns, values) if column in required and not value]
+            if blank:
+                reject_row(report, number, values[0], f"Missing {', '.join(blank)}")
+                continue
+            if table == "faculty" and not values[0].isdigit():
+                reject_row(report, number, values[0], "Faculty code must be numeric")
                 continue
 
-        conn.commit()
+            if diff:
+                old_hash = current.get(values[0])
+                new_hash = roster_row_hash(values)
+                if old_hash == new_hash:
+                    report["unchanged"] += 1
+                    continue
+                current[values[0]] = new_hash  # a repeated row in the file counts once
+                if old_hash is None:
+                    list_sample(report, "adds", values[0])
+                else:
+                    list_sample(report, "changes", values[0])
+                if dry_run:
+                    report["inserted" if old_hash is None else "updated"] += 1
+                    continue
+
+            batch.append((number, values))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                upsert_roster_batch(cursor, table, columns, batch, report)
+                batch = []
+        if batch:
+            upsert_roster_batch(cursor, table, columns, batch, report)
+
+        if diff and delete_missing:
+            missing = sorted(set(current) - seen)
+            report["deleted"] = len(missing)
+            report["removals"] = missing[:IMPORT_REPORT_ERRORS]
+            if missing and not dry_run:
+                delete_roster_rows(cursor, table, missing)
+
+        wrote = not dry_run and (report["inserted"] or report["updated"] or report["deleted"])
+        if wrote:
+            # Only a real change makes the kiosk and caches reload the roster
+            bump_roster_version(cursor)
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         cursor.close()
         conn.close()
+    if wrote:
+        response_cache.invalidate("roster")
+    return report
+
+def import_summary(label, report):
+    if report["dry_run"]:
+        text = (f"Dry run for {label}: {report['inserted']} to add, {report['updated']} to change, "
+                f"{report['deleted']} to remove, {report['unchanged']} unchanged")
+    else:
+        text = f"{label} imported: {report['inserted']} added, {report['updated']} updated"
+        if report["mode"] == "diff":
+            text += f", {report['deleted']} removed, {report['unchanged']} unchanged"
+    return f"{text}, {report['rejected']} rejected."
+
+# ------------------- Import jobs -------------------
+# Uploads are saved to UPLOAD_FOLDER and imported by a small thread pool, so
+# the request returns at once. Job state lives in import_jobs, where any
+# worker process can answer the status poll. The process holding a queued or
+# running job touches its heartbeat_at every IMPORT_HEARTBEAT_SECONDS; a job
+# whose heartbeat is older than IMPORT_STALE_SECONDS lost its worker (crash,
+# killed past the graceful timeout) and is reported as failed.
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+IMPORT_HEARTBEAT_SECONDS = int(os.getenv("IMPORT_HEARTBEAT_SECONDS", "10"))
+IMPORT_STALE_SECONDS = int(os.getenv("IMPORT_STALE_SECONDS", "60"))
+import_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="roster-import")
+active_import_jobs = set()
+active_import_jobs_lock = threading.Lock()
+
+def ensure_import_jobs_table():
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id CHAR(32) PRIMARY KEY,
+                roster VARCHAR(16) NOT NULL,
+                filename VARCHAR(255),
+                status VARCHAR(16) NOT NULL,
+                rows_total INT,
+                rows_done INT NOT NULL DEFAULT 0,
+                created_at DATETIME NOT NULL,
+                started_at DATETIME,
+                finished_at DATETIME,
+                heartbeat_at DATETIME,
+                report MEDIUMTEXT,
+                error TEXT
+            )
+        """)
+        cur.close()
+        conn.close()
+    except mysql.connector.Error as e:
+        print("Could not create import_jobs table:", e)
 
-        return jsonify({"success": "Students imported successfully"})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+def update_import_job(conn, job_id, **fields):
+    cur = conn.cursor()
+    cur.execute(f"UPDATE import_jobs SET {', '.join(f'{name} = %s' for name in fields)} WHERE id = %s",
+                (*fields.values(), job_id))
+    conn.commit()
+    cur.close()
 
+def touch_import_jobs():
+    """Scheduled: refresh heartbeat_at of the jobs this process has queued or running"""
+    with active_import_jobs_lock:
+        job_ids = list(active_import_jobs)
+    if not job_ids:
+        return
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"UPDATE import_jobs SET heartbeat_at = %s WHERE id IN ({', '.join(['%s'] * len(job_ids))})",
+                    (datetime.now(), *job_ids))
+        conn.commit()
+        cur.close()
+        conn.close()
+    except mysql.connector.Error as e:
+        print("Could not update import job heartbeats:", e)
 
-# ------------------- Import Faculties -------------------
-@app.route("/import/faculties", methods=["POST"])
-def import_faculties():
+def count_sheet_rows(path):
+    """Data rows in the first sheet as recorded in its dimension, if the file has one"""
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        max_row = workbook.worksheets[0].max_row
+        return max_row - 1 if max_row else None
+    finally:
+        workbook.close()
+
+def run_import_job(job_id, path, table, options):
+    # Progress goes through its own connection: the import's transaction
+    # is not visible to the status endpoint until it commits
+    conn = get_db_connection()
+    try:
+        update_import_job(conn, job_id, status="running", started_at=datetime.now(),
+                          rows_total=count_sheet_rows(path))
+        report = import_roster(path, table, progress=lambda report: update_import_job(
+            conn, job_id, rows_done=report["processed"]), **options)
+        update_import_job(conn, job_id, status="done", finished_at=datetime.now(),
+                          rows_done=report["processed"], report=json.dumps(report))
+    except Exception as e:
+        print(f"Import job {job_id} failed: {e}")
+        update_import_job(conn, job_id, status="failed", finished_at=datetime.now(), error=str(e))
+    finally:
+        with active_import_jobs_lock:
+            active_import_jobs.discard(job_id)
+        conn.close()
+        os.remove(path)
+
+def start_roster_import(table):
     if "file" not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
 
     file = request.files["file"]
     if file.filename == "":
         return jsonify({"error": "Empty filename"}), 400
-
+    if not allowed_file(file.filename):
+        return jsonify({"error": "Upload an .xlsx file"}), 400
+
+    options = {
+        "mode": request.form.get("mode", "diff"),
+        "dry_run": request.form.get("dry_run") in ("1", "true", "on"),
+        "delete_missing": request.form.get("delete_missing") in ("1", "true", "on"),
+    }
+    if options["mode"] not in ("diff", "upsert"):
+        return jsonify({"error": "mode must be diff or upsert"}), 400
+    if options["mode"] == "upsert" and (options["dry_run"] or options["delete_missing"]):
+        return jsonify({"error": "dry_run and delete_missing need mode=diff"}), 400
+
+    job_id = uuid.uuid4().hex
+    path = os.path.join(app.config["UPLOAD_FOLDER"], f"{job_id}.xlsx")
+    file.save(path)
     try:
-        df = pd.read_excel(file, dtype=str)
-        df = df.where(pd.notnull(df), None)
-
         conn = get_db_connection()
-        cursor = conn.cursor()
-
-        for _, row in df.iterrows():
-            try:
-                cursor.execute("""
-                    INSERT INTO faculty (full_reg_no, name, email)
-                    VALUES (%s, %s, %s)
-                    ON DUPLICATE KEY UPDATE 
-                        name = VALUES(name),
-                        email = VALUES(email)
-                """, (
-                    row.get("full_reg_no"),
-                    row.get("name"),
-                    row.get("email")
-                ))
-            except Exception as e:
-                print(f"Skipping row due to error: {e}")
-                continue
-
+        cur = conn.cursor()
+        now = datetime.now()
+        cur.execute("""
+            INSERT INTO import_jobs (id, roster, filename, status, created_at, heartbeat_at)
+            VALUES (%s, %s, %s, 'queued', %s, %s)
+        """, (job_id, table, secure_filename(file.filename), now, now))
         conn.commit()
-        cursor.close()
+        cur.close()
         conn.close()
-
-        return jsonify({"success": "Faculties imported successfully"})
-    except Exception as e:
+    except mysql.connector.Error as e:
+        os.remove(path)
         return jsonify({"error": str(e)}), 500
 
+    with active_import_jobs_lock:
+        active_import_jobs.add(job_id)
+    import_executor.submit(run_import_job, job_id, path, table, options)
+    return jsonify({"job_id": job_id, "status_url": f"/import/jobs/{job_id}"}), 202
 
-# export database to excel
-@app.route("/export/students")
-def export_students():
+IMPORT_LABELS = {"students": "Students", "faculty": "Faculties"}
+
+@app.route("/import/jobs/<job_id>", methods=["GET"])
+def import_job_status(job_id):
+    """Progress of an import: rows done, throughput, ETA and finally the report"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT full_reg_no, name, branch, year FROM students")
-    rows = cursor.fetchall()
-    cursor.close()
+    cur = conn.cursor(dictionary=True, buffered=True)
+    cur.execute("SELECT * FROM import_jobs WHERE id = %s", (job_id,))
+    job = cur.fetchone()
+    if job and job["status"] in ("queued", "running"):
+        # No heartbeat: the worker holding the job is gone, so it will never finish
+        stale_before = datetime.now() - timedelta(seconds=IMPORT_STALE_SECONDS)
+        heartbeat = job["heartbeat_at"] or job["created_at"]
+        if heartbeat < stale_before:
+            error = f"The import worker stopped responding (no heartbeat since {heartbeat:%H:%M:%S})."
+            cur.execute("""
+                UPDATE import_jobs SET status = 'failed', finished_at = %s, error = %s
+                WHERE id = %s AND status IN ('queued', 'running')
+            """, (datetime.now(), error, job_id))
+            conn.commit()
+            if cur.rowcount:
+                job.update(status="failed", finished_at=datetime.now(), error=error)
+                upload = os.path.join(app.config["UPLOAD_FOLDER"], f"{job_id}.xlsx")
+                if os.path.exists(upload):
+                    os.remove(upload)
+            else:
+                cur.execute("SELECT * FROM import_jobs WHERE id = %s", (job_id,))
+                job = cur.fetchone()
+    cur.close()
     conn.close()
+    if not job:
+        return jsonify({"error": "Unknown import job"}), 404
+
+    elapsed = None
+    if job["started_at"]:
+        elapsed = ((job["finished_at"] or datetime.now()) - job["started_at"]).total_seconds()
+    rate = job["rows_done"] / elapsed if elapsed else None
+    eta = None
+    if rate and job["rows_total"] and job["status"] == "running":
+        eta = round(max(job["rows_total"] - job["rows_done"], 0) / rate, 1)
+
+    result = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "rows_total": job["rows_total"],
+        "rows_done": job["rows_done"],
+        "elapsed_seconds": round(elapsed, 1) if elapsed is not None else None,
+        "rows_per_second": round(rate, 1) if rate else None,
+        "eta_seconds": eta,
+    }
+    if job["status"] == "done":
+        report = json.loads(job["report"])
+        result["report"] = report
+        result["success"] = import_summary(IMPORT_LABELS[job["roster"]], report)
+    elif job["status"] == "failed":
+        result["error"] = job["error"]
+    return jsonify(result)
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Students"
-
-    # headers
-    ws.append(["full_reg_no", "name", "branch", "year"])
-    for row in rows:
-        ws.append(row)
-
-    # save to memory
-    file_stream = io.BytesIO()
-    wb.save(file_stream)
-    file_stream.seek(0)
 
-    return send_file(file_stream, as_attachment=True, download_name="students.xlsx", mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-
-@app.route("/export/faculties")
-def export_faculties():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT full_reg_no, name, email FROM faculty")
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
+# ------------------- Import Students -------------------
+@app.route("/import/students", methods=["POST"])
+def import_students():
+    return start_roster_import("students")
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Faculties"
 
-    # headers
-    ws.append(["full_reg_no", "name", "email"])
-    for row in rows:
-        ws.append(row)
+# ------------------- Import Faculties -------------------
+@app.route("/import/faculties", methods=["POST"])
+def import_faculties():
+    return start_roster_import("faculty")
 
-    file_stream = io.BytesIO()
-    wb.save(file_stream)
-    file_stream.seek(0)
 
-    return send_file(file_stream, as_attachment=True, download_name="faculties.xlsx", mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+# export database to excel
+@app.route("/export/students")
+def export_students():
+    return roster_export("students", ["full_reg_no", "name", "branch", "year"], "Students", "students.xlsx")
 
+@app.route("/export/faculties")
+def export_faculties():
+    return roster_export("faculty", ["full_reg_no", "name", "email"], "Faculties", "faculties.xlsx")
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    if sys.argv[1:] == ["archive-logs"]:
+        # One archiving run now instead of waiting for ARCHIVE_HOUR
+        ensure_meta_table()
+        print(f"Archived {archive_logs()} logs.")
+        sys.exit(0)
+    if sys.argv[1:] == ["rebuild-rollups"]:
+        # Backfill entry_rollup from the whole logs history, then exit
+        ensure_meta_table()
+        ensure_rollup_table()
+        print(f"Rebuilt entry_rollup: {catch_up_rollups(full=True)} buckets.")
+        sys.exit(0)
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_up()
+    app.run(debug=DEBUG, host='0.0.0.0', port=5001)
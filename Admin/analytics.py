@@ -0,0 +1,139 @@
+"""Stay length and occupancy analytics for the Admin dashboard.
+
+Visits (entry/exit pairs) are pulled from logs with one query per date range
+and handled as NumPy arrays, never row by row:
+
+- stay lengths are one subtraction over the closed visits;
+- the occupancy curve (people inside during each bucket of the day) is two
+  searchsorted calls over the sorted entry and exit times;
+- the daily peak is a cumulative sum over the merged +1 / -1 events.
+
+Days before yesterday can no longer change (yesterday may still get scans
+flushed late, as with the entry rollup), so their results are stored in
+day_analytics and computed only once per bucket size.
+"""
+import os
+import json
+from datetime import timedelta
+import numpy as np
+
+BUCKET_MINUTES = int(os.getenv("ANALYTICS_BUCKET_MINUTES", "15"))
+DAY_SECONDS = 24 * 60 * 60
+
+
+def create_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS day_analytics (
+            stat_date DATE NOT NULL,
+            bucket_minutes SMALLINT NOT NULL,
+            stats MEDIUMTEXT NOT NULL,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (stat_date, bucket_minutes)
+        )
+    """)
+
+
+def fetch_visits(cursor, start, end, tables=("logs",)):
+    """(day index from `start`, entry second, exit second or NaN) arrays for entry dates start..end
+
+    Seconds count from midnight of the entry day, so a visit that ends after
+    midnight exits past DAY_SECONDS. `tables` are the log tables to read.
+    """
+    select = """
+        SELECT DATEDIFF(entry_date, %s),
+               TIME_TO_SEC(entry_time),
+               CASE WHEN is_open = 0
+                    THEN TIMESTAMPDIFF(SECOND, TIMESTAMP(entry_date), TIMESTAMP(exit_date, exit_time))
+               END
+        FROM {}
+        WHERE entry_date BETWEEN %s AND %s AND entry_time IS NOT NULL
+    """
+    cursor.execute(" UNION ALL ".join(select.format(table) for table in tables), (start, start, end) * len(tables))
+    rows = np.array(cursor.fetchall(), dtype=float).reshape(-1, 3)  # NULL -> NaN
+    return rows[:, 0].astype(int), rows[:, 1], rows[:, 2]
+
+
+def day_stats(entered, exited, horizon=DAY_SECONDS, bucket_minutes=BUCKET_MINUTES):
+    """Stay and occupancy figures of one day's visits.
+
+    `horizon` is the end of the observed day in seconds: DAY_SECONDS for a
+    past day, the current time for today. Visits without an exit count as
+    inside until the horizon; they are left out of the stay lengths.
+    """
+    closed = ~np.isnan(exited)
+    stays = exited[closed] - entered[closed]
+    stays = stays[stays >= 0]
+    left = np.where(closed, np.maximum(exited, entered), horizon)
+    left = np.minimum(left, horizon)
+
+    # Inside during [b, b + size): entered before the bucket ends and left after it starts
+    size = bucket_minutes * 60
+    starts = np.arange(0, DAY_SECONDS, size)
+    occupancy = (np.searchsorted(np.sort(entered), starts + size, side="left")
+                 - np.searchsorted(np.sort(left), starts, side="right"))
+    curve = [int(n) if start < horizon else None for start, n in zip(starts, occupancy)]
+
+    peak, peak_at = 0, None
+    if len(entered):
+        times = np.concatenate([entered, left])
+        steps = np.concatenate([np.ones(len(entered)), -np.ones(len(left))])
+        order = np.lexsort((steps, times))  # by time, exits before entries at the same second
+        inside = np.cumsum(steps[order])
+        i = int(np.argmax(inside))
+        peak, peak_at = int(inside[i]), int(times[order][i])
+
+    return {
+        "visits": int(len(entered)),
+        "open_visits": int((~closed).sum()),
+        "average_stay_seconds": round(float(stays.mean()), 1) if len(stays) else None,
+        "median_stay_seconds": round(float(np.median(stays)), 1) if len(stays) else None,
+        "peak_occupancy": peak,
+        "peak_at": f"{peak_at // 3600:02d}:{peak_at % 3600 // 60:02d}" if peak_at is not None else None,
+        "bucket_minutes": bucket_minutes,
+        "occupancy": curve,
+    }
+
+
+def compute_days(cursor, start, end, horizons, tables=("logs",)):
+    """day_stats() of every date start..end from one bulk query; `horizons` maps a date to its horizon"""
+    days, entered, exited = fetch_visits(cursor, start, end, tables)
+    order = np.argsort(days, kind="stable")
+    days, entered, exited = days[order], entered[order], exited[order]
+
+    count = (end - start).days + 1
+    bounds = np.searchsorted(days, np.arange(count + 1))
+    results = {}
+    for i in range(count):
+        day = start + timedelta(days=i)
+        lo, hi = bounds[i], bounds[i + 1]
+        results[day] = dict(day_stats(entered[lo:hi], exited[lo:hi], horizons.get(day, DAY_SECONDS)),
+                            date=day.isoformat())
+    return results
+
+
+def days_analytics(conn, start, end, today, now_seconds, tables=("logs",)):
+    """day_stats() for each date start..end (oldest first), reusing and filling the closed-day store"""
+    closed_before = today - timedelta(days=1)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT stat_date, stats FROM day_analytics
+            WHERE stat_date BETWEEN %s AND %s AND bucket_minutes = %s
+        """, (start, end, BUCKET_MINUTES))
+        results = {day: json.loads(stats) for day, stats in cursor.fetchall()}
+
+        wanted = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        missing = [day for day in wanted if day not in results and day <= today]
+        if missing:
+            computed = compute_days(cursor, missing[0], missing[-1], {today: now_seconds}, tables)
+            fresh = [day for day in missing if day < closed_before]
+            if fresh:
+                cursor.executemany("""
+                    INSERT INTO day_analytics (stat_date, bucket_minutes, stats) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE stats = VALUES(stats), computed_at = CURRENT_TIMESTAMP
+                """, [(day, BUCKET_MINUTES, json.dumps(computed[day])) for day in fresh])
+                conn.commit()
+            results.update((day, computed[day]) for day in missing)
+        return [results[day] for day in wanted if day in results]
+    finally:
+        cursor.close()
@@ -94,19 +94,137 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     // --- LIVE STATS (NEW) ---
+    function renderLiveStats(data) {
+        document.getElementById('entries-today').textContent = data.total_entries_today;
+        document.getElementById('currently-inside').textContent = data.currently_inside;
+        document.getElementById('peak-hour').textContent = data.peak_hour_today;
+    }
+
     function updateLiveStats() {
         fetch('/api/stats')
+            .then(response => response.json())
+            .then(renderLiveStats)
+            .catch(error => console.error('Error fetching live stats:', error));
+    }
+
+    // --- WHO'S INSIDE TABLE ---
+    function renumberInsideRows(insideBody) {
+        const rows = insideBody.querySelectorAll("tr[data-reg]");
+        rows.forEach((row, idx) => { row.cells[0].textContent = idx + 1; });
+
+        let emptyRow = insideBody.querySelector("tr.empty-row");
+        if (rows.length === 0 && !emptyRow) {
+            emptyRow = document.createElement("tr");
+            emptyRow.className = "empty-row";
+            emptyRow.innerHTML = '<td colspan="3" style="text-align: center; padding: 20px;">The library is currently empty.</td>';
+            insideBody.appendChild(emptyRow);
+        } else if (rows.length > 0 && emptyRow) {
+            emptyRow.remove();
+        }
+    }
+
+    function applyOccupancyDelta(delta) {
+        const insideBody = document.getElementById("users-inside-body");
+        (delta.exited || []).forEach(regNo => {
+            const row = insideBody.querySelector(`tr[data-reg="${CSS.escape(regNo)}"]`);
+            if (row) row.remove();
+        });
+        (delta.entered || []).forEach(user => {
+            if (insideBody.querySelector(`tr[data-reg="${CSS.escape(user.full_reg_no)}"]`)) return;
+            const row = document.createElement("tr");
+            row.dataset.reg = user.full_reg_no;
+            [ "", user.full_reg_no.slice(-5), user.name ].forEach(text => {
+                const cell = document.createElement("td");
+                cell.textContent = text;
+                row.appendChild(cell);
+            });
+            insideBody.appendChild(row);
+        });
+        renumberInsideRows(insideBody);
+    }
+
+    function replaceInsideRows(users) {
+        const insideBody = document.getElementById("users-inside-body");
+        insideBody.querySelectorAll("tr[data-reg]").forEach(row => row.remove());
+        applyOccupancyDelta({ entered: users, exited: [] });
+    }
+
+    // Fetch only the entries/exits since the version this page last saw
+    function syncOccupancy() {
+        const insideBody = document.getElementById("users-inside-body");
+        const params = new URLSearchParams({
+            since: insideBody.dataset.version || "",
+            epoch: insideBody.dataset.epoch || ""
+        });
+        fetch(`/api/occupancy?${params}`)
             .then(response => response.json())
             .then(data => {
-                document.getElementById('entries-today').textContent = data.total_entries_today;
+                if (data.full) {
+                    replaceInsideRows(data.users);
+                } else {
+                    applyOccupancyDelta(data);
+                }
+                insideBody.dataset.version = data.version;
+                insideBody.dataset.epoch = data.epoch;
                 document.getElementById('currently-inside').textContent = data.currently_inside;
-                document.getElementById('peak-hour').textContent = data.peak_hour_today;
             })
-            .catch(error => console.error('Error fetching live stats:', error));
+            .catch(error => console.error('Error syncing occupancy:', error));
+    }
+
+    // --- TOAST ---
+    function showToast(message, isError) {
+        const toast = document.getElementById("toast");
+        if (!toast || !message) return;
+        toast.textContent = message;
+        toast.style.backgroundColor = isError ? "#d9534f" : "#4169e1";
+        toast.classList.add("show");
+        setTimeout(() => toast.classList.remove("show"), 4000);
+    }
+
+    // --- LIVE UPDATES ---
+    // Prefer the server's event stream; poll only while it is unavailable
+    let pollTimer = null;
+
+    function startPolling() {
+        if (pollTimer) return;
+        updateLiveStats();
+        syncOccupancy();
+        pollTimer = setInterval(() => { updateLiveStats(); syncOccupancy(); }, 15000);
+    }
+
+    function stopPolling() {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+
+    function startLiveStream() {
+        if (!window.EventSource) return startPolling();
+        const insideBody = document.getElementById("users-inside-body");
+        const params = new URLSearchParams({
+            since: insideBody.dataset.version || "",
+            epoch: insideBody.dataset.epoch || ""
+        });
+        const stream = new EventSource(`/api/stream?${params}`);
+        stream.addEventListener('open', stopPolling);
+        stream.addEventListener('occupancy', event => {
+            const data = JSON.parse(event.data);
+            const insideBody = document.getElementById("users-inside-body");
+            if (data.full) {
+                replaceInsideRows(data.users);
+            } else {
+                applyOccupancyDelta(data);
+            }
+            insideBody.dataset.version = data.version;
+            insideBody.dataset.epoch = data.epoch;
+            renderLiveStats(data.stats);
+        });
+        // EventSource reconnects by itself (sending Last-Event-ID); keep the
+        // page fresh meanwhile, and for good if the server refused the stream
+        stream.addEventListener('error', startPolling);
     }
 
     updateLiveStats();
-    setInterval(updateLiveStats, 15000);
+    startLiveStream();
     // ===== MAIN UI INITIALIZATION =====
     function initMainUI() {
         const logo = document.getElementById("logo");
@@ -199,23 +317,24 @@ document.addEventListener("DOMContentLoaded", () => {
 
             enrollError.textContent = "";
 
-            // Prepare form data to check user status
-           const formData = new FormData();
+            // One request validates the code, records the entry/exit and
+            // returns the occupancy change, so the page updates in place.
+            const formData = new FormData();
             formData.append('registry_last_digits', value);
             formData.append('role', selectedRole);
 
-            fetch('/check-status', {
+            submitBtn.disabled = true;
+            fetch('/api/scan', {
                 method: 'POST',
                 body: formData
             })
                 .then(response => response.json())
                 .then(data => {
                     if (data.success) {
-                        // No matter if user is inside or outside, the action is the same: submit the main form.
-                        // The backend /check route will handle both entry and exit.
-                        hiddenEnroll.value = value;
-                        hiddenRole.value = selectedRole;
-                        enrollForm.submit();
+                        applyOccupancyDelta(data.occupancy);
+                        if (data.stats) renderLiveStats(data.stats);
+                        showToast(data.message, false);
+                        hideLoginPanel();
                     } else {
                         enrollError.textContent = data.error || "Invalid user or role.";
                     }
@@ -223,7 +342,8 @@ document.addEventListener("DOMContentLoaded", () => {
                 .catch(error => {
                     enrollError.textContent = "System error. Please try again.";
                     console.error(error);
-                });
+                })
+                .finally(() => { submitBtn.disabled = false; });
         });
 
         document.addEventListener("keydown", (e) => {
@@ -282,14 +402,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
         const toast = document.getElementById("toast");
         if (toast) {
-            const message = toast.getAttribute("data-message");
-            const isError = toast.getAttribute("data-type") === "error";
-            if (message) {
-                toast.textContent = message;
-                toast.style.backgroundColor = isError ? "#d9534f" : "#4169e1";
-                toast.classList.add("show");
-                setTimeout(() => toast.classList.remove("show"), 4000);
-            }
+            showToast(toast.getAttribute("data-message"), toast.getAttribute("data-error") === "true");
         }
     }
 });
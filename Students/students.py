@@ -1,15 +1,39 @@
 import apscheduler
-from flask import Flask, render_template, request, redirect, url_for, flash, get_flashed_messages, send_from_directory, jsonify
-from datetime import datetime
+import itertools
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from flask import Flask, render_template, request, redirect, url_for, flash, get_flashed_messages, send_from_directory, jsonify, Response
+from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 import mysql.connector
+from mysql.connector import errorcode
 import pytz
 import atexit
 import traceback
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Shared modules (query_profiler, migrate) live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import query_profiler
+import migrate
+
 app = Flask(__name__, static_folder='.', template_folder='.')
 app.secret_key = 'your_secret_key'
-app.config['DEBUG'] = True  # Enable debug mode
+# Debug mode (and the reloader) only when explicitly asked for: APP_DEBUG=1
+DEBUG = os.getenv('APP_DEBUG', '0') == '1'
+app.config['DEBUG'] = DEBUG
 
 IST = pytz.timezone('Asia/Kolkata')
 
@@ -21,46 +45,203 @@ DB_CONFIG = {
     'database': 'lib_main'
 }
 
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Times every statement; the Admin app's /api/query_stats shows the results
+profiler = query_profiler.QueryProfiler('students')
+QUERY_STATS_FLUSH_SECONDS = int(os.getenv('QUERY_STATS_FLUSH_SECONDS', '60'))
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+
 def get_db_connection():
     """Get database connection with error handling"""
     try:
-        return mysql.connector.connect(**DB_CONFIG)
+        return profiler.wrap(mysql.connector.connect(**DB_CONFIG))
     except mysql.connector.Error as err:
         print(f"Database connection error: {err}")
         return None
 
+class ConnectionPool:
+    """Thread-safe pool of MySQL connections used by execute_query.
+
+    Connections are opened lazily up to `size`; once all are borrowed,
+    callers wait up to `timeout` seconds for one to come back. Every
+    connection is pinged when borrowed so one dropped by the server
+    (wait_timeout, restart) is replaced instead of failing the scan.
+    """
+
+    def __init__(self, config, size=5, timeout=5.0):
+        self.config = dict(config, autocommit=True)
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._counters = {'borrowed': 0, 'waiting': 0, 'created': 0, 'broken': 0}
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._counters[key] += delta
+
+    def _create(self):
+        conn = profiler.wrap(mysql.connector.connect(**self.config))
+        self._count('created')
+        return conn
+
+    def _discard(self, conn):
+        self._count('broken')
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+
+    def _take(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._open < self.size
+            if can_open:
+                self._open += 1
+        if can_open:
+            try:
+                return self._create()
+            except mysql.connector.Error:
+                with self._lock:
+                    self._open -= 1
+                raise
+
+        self._count('waiting')
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise mysql.connector.errors.PoolError(
+                f"No free connection after {self.timeout}s (pool size {self.size})")
+        finally:
+            self._count('waiting', -1)
+
+    def acquire(self):
+        """Borrow a validated connection from the pool."""
+        conn = self._take()
+        try:
+            conn.ping(reconnect=False)
+        except mysql.connector.Error:
+            self._discard(conn)
+            with self._lock:
+                self._open += 1
+            try:
+                conn = self._create()
+            except mysql.connector.Error:
+                with self._lock:
+                    self._open -= 1
+                raise
+        self._count('borrowed')
+        return conn
+
+    def release(self, conn, broken=False):
+        """Return a borrowed connection, or drop it if it is no longer usable."""
+        self._count('borrowed', -1)
+        if broken:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def warm(self, count):
+        """Open up to `count` connections ahead of the first request"""
+        borrowed = []
+        try:
+            for _ in range(min(count, self.size)):
+                borrowed.append(self.acquire())
+        except mysql.connector.Error as err:
+            print(f"Pool warm-up stopped early: {err}")
+        for conn in borrowed:
+            self.release(conn)
+        return len(borrowed)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            # Lost or unusable connection (server gone away, timeout, protocol error)
+            self.release(conn, broken=True)
+            raise
+        except Exception:
+            # A statement failed (duplicate key, bad SQL, ...) but the connection
+            # is fine; keep it unless even a rollback fails
+            self.release(conn, broken=not self._reset(conn))
+            raise
+        else:
+            self.release(conn)
+
+    def _reset(self, conn):
+        """Roll back anything the failed caller left open; False if the connection is dead"""
+        try:
+            conn.rollback()
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, size=self.size, open=self._open,
+                        idle=self._idle.qsize())
+
+db_pool = ConnectionPool(DB_CONFIG, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT)
+
 def execute_query(query, params=None, fetch=False, fetch_one=False):
-    """Execute query with proper error handling"""
-    conn = get_db_connection()
-    if not conn:
-        return None
-    
+    """Execute query on a pooled connection with proper error handling"""
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query, params or ())
-        
-        if fetch_one:
-            result = cursor.fetchone()
-        elif fetch:
-            result = cursor.fetchall()
-        else:
-            conn.commit()
-            result = cursor.rowcount
-            
-        cursor.close()
-        conn.close()
-        return result
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(dictionary=True, buffered=True)
+            cursor.execute(query, params or ())
+
+            if fetch_one:
+                result = cursor.fetchone()
+            elif fetch:
+                result = cursor.fetchall()
+            else:
+                conn.commit()
+                result = cursor.rowcount
+
+            cursor.close()
+            return result
     except mysql.connector.Error as err:
         print(f"Query execution error: {err}")
-        if conn:
-            conn.close()
         return None
 
+# --- APP METADATA ---
+def ensure_meta_table():
+    """Create the key/value table shared with the Admin app (roster version etc.)"""
+    query = """CREATE TABLE IF NOT EXISTS app_meta (
+                   meta_key VARCHAR(64) PRIMARY KEY,
+                   meta_value VARCHAR(255),
+                   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+               )"""
+    return execute_query(query)
+
+def get_meta(key):
+    """Read a value from app_meta, or None if missing/unavailable"""
+    row = execute_query("SELECT meta_value FROM app_meta WHERE meta_key = %s", (key,), fetch_one=True)
+    return row['meta_value'] if row else None
+
+def set_meta(key, value):
+    """Store a value in app_meta"""
+    query = """INSERT INTO app_meta (meta_key, meta_value) VALUES (%s, %s)
+               ON DUPLICATE KEY UPDATE meta_value = VALUES(meta_value)"""
+    return execute_query(query, (key, str(value)))
+
 # --- USER FINDER FUNCTIONS ---
 def find_student(registry_code):
     """Find student by last digits of registration number"""
-    query = "SELECT * FROM students WHERE full_reg_no LIKE %s"
-    return execute_query(query, (f'%{registry_code}',), fetch_one=True)
+    query = "SELECT * FROM students WHERE reg_suffix5 = %s"
+    return execute_query(query, (registry_code,), fetch_one=True)
 
 def find_faculty(registry_code):
     """Find faculty by exact registration number"""
@@ -70,21 +251,90 @@ def find_faculty(registry_code):
     except ValueError:
         return None
 
+# --- ROSTER INDEX ---
+ROSTER_REFRESH_SECONDS = int(os.getenv('ROSTER_REFRESH_SECONDS', '15'))
+
+class RosterIndex:
+    """In-memory roster keyed by 5-digit student suffix and faculty code.
+
+    Loaded once at startup and reloaded whenever the Admin imports bump
+    `roster_version` in app_meta, so scans resolve users without a query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._students = {}
+        self._faculty = {}
+        self.version = None
+        self.loaded = False
+
+    def load(self):
+        """(Re)build the index from the students and faculty tables"""
+        version = get_meta('roster_version')
+        students = execute_query("SELECT * FROM students", fetch=True)
+        faculty = execute_query("SELECT * FROM faculty", fetch=True)
+        if students is None or faculty is None:
+            return False
+
+        by_suffix = {}
+        for row in students:
+            by_suffix.setdefault(str(row['full_reg_no'])[-5:], []).append(row)
+
+        by_code = {}
+        for row in faculty:
+            try:
+                by_code[int(row['full_reg_no'])] = row
+            except (TypeError, ValueError):
+                continue
+
+        with self._lock:
+            self._students = by_suffix
+            self._faculty = by_code
+            self.version = version
+            self.loaded = True
+        print(f"[ROSTER] Indexed {len(students)} students, {len(by_code)} faculty (version {version}).")
+        return True
+
+    def refresh_if_changed(self):
+        """Reload when the Admin app has imported a new roster"""
+        version = get_meta('roster_version')
+        if not self.loaded or version != self.version:
+            self.load()
+
+    def students(self, suffix):
+        """All students whose registration number ends in `suffix`"""
+        with self._lock:
+            return list(self._students.get(suffix, ()))
+
+    def faculty(self, code):
+        with self._lock:
+            return self._faculty.get(int(code))
+
+roster = RosterIndex()
+
 def find_user_and_validate(registry_code, role):
     """Find user and validate input"""
     if not registry_code or not role:
         return None, "Please enter registration code and select role."
     
     registry_code = registry_code.strip()
+    if not roster.loaded:
+        roster.load()
     
     if role == 'Student':
         if not registry_code.isdigit() or len(registry_code) != 5:
             return None, "Enter a valid 5-digit code for Student."
-        user = find_student(registry_code)
+        if roster.loaded:
+            matches = roster.students(registry_code)
+            if len(matches) > 1:
+                return None, "That code matches more than one Student. Please contact the library desk."
+            user = matches[0] if matches else None
+        else:
+            user = find_student(registry_code)
     elif role == 'Faculty':
         if not registry_code.isdigit() or len(registry_code) != 4:
             return None, "Enter a valid 4-digit code for Faculty."
-        user = find_faculty(registry_code)
+        user = roster.faculty(registry_code) if roster.loaded else find_faculty(registry_code)
     else:
         return None, "Invalid role selected."
     
@@ -93,47 +343,500 @@ def find_user_and_validate(registry_code, role):
     
     return user, None
 
+# --- OCCUPANCY REGISTRY ---
+OCCUPANCY_RECONCILE_SECONDS = int(os.getenv('OCCUPANCY_RECONCILE_SECONDS', '60'))
+OCCUPANCY_CHANGELOG_SIZE = int(os.getenv('OCCUPANCY_CHANGELOG_SIZE', '2000'))
+
+def format_clock(value):
+    """TIME column value (timedelta from MySQL, or a time) -> zero-padded 'HH:MM:SS'"""
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return value.strftime('%H:%M:%S')
+
+def public_record(record):
+    """Occupancy record with dates/times as strings for JSON (times as 'HH:MM:SS', so they sort as text)"""
+    formatted = dict(record)
+    if formatted.get('entry_date') is not None:
+        formatted['entry_date'] = str(formatted['entry_date'])
+    if formatted.get('entry_time') is not None:
+        formatted['entry_time'] = format_clock(formatted['entry_time'])
+    return formatted
+
+class OccupancyRegistry:
+    """Users currently inside the library, keyed by full_reg_no.
+
+    Rebuilt from the open logs at startup, updated in place on every entry
+    and exit, and periodically reconciled against MySQL to catch drift
+    (manual edits, scans taken by another worker). The kiosk's live feed is
+    only complete with one worker, which is how serve.py runs it; the epoch
+    changes with the process. Every change bumps `version` and is
+    kept in a bounded changelog so clients can ask for just the changes
+    since the version they last saw.
+    """
+
+    def __init__(self):
+        # A Condition so stream subscribers can wait for the next change
+        self._lock = threading.Condition()
+        self._inside = {}
+        self._changes = deque(maxlen=OCCUPANCY_CHANGELOG_SIZE)
+        self.epoch = f"{WORKER_ID}:{int(time.time())}"
+        self.version = 0
+        self.loaded = False
+
+    def _log(self, op, full_reg_no, record=None):
+        self.version += 1
+        self._changes.append((self.version, op, full_reg_no, record))
+        self._lock.notify_all()
+
+    def _replace(self, inside):
+        """Swap in a new set of users, logging the differences; returns (added, removed)"""
+        added = inside.keys() - self._inside.keys()
+        removed = self._inside.keys() - inside.keys()
+        for key in removed:
+            self._log('exit', key)
+        for key in added:
+            self._log('entry', key, inside[key])
+        self._inside = inside
+        self.loaded = True
+        return added, removed
+
+    def _fetch_open_logs(self):
+        query = """SELECT full_reg_no, name, branch, year, role, entry_date, entry_time FROM logs
+                   WHERE is_open = 1
+                   ORDER BY entry_date, entry_time"""
+        rows = execute_query(query, fetch=True)
+        if rows is None:
+            return None
+        return {str(row['full_reg_no']): row for row in rows}
+
+    def rebuild(self):
+        """Replace the registry with the open logs in the database"""
+        inside = self._fetch_open_logs()
+        if inside is None:
+            return False
+        with self._lock:
+            self._replace(inside)
+        return True
+
+    def reconcile(self):
+        """Re-read the open logs and report any drift that was corrected"""
+        # In write-behind mode the registry decides entry or exit, so no scan
+        # may be journaled between the pending check and the swap
+        with journal_paused():
+            if journal and journal.has_pending():
+                return
+            actual = self._fetch_open_logs()
+            if actual is None:
+                return
+            with self._lock:
+                added, removed = self._replace(actual)
+        if added or removed:
+            print(f"[OCCUPANCY] Reconciled with database: +{len(added)} / -{len(removed)} users.")
+
+    def ensure_loaded(self):
+        return self.loaded or self.rebuild()
+
+    def enter(self, user, role, now):
+        record = {
+            'full_reg_no': str(user['full_reg_no']),
+            'name': user['name'],
+            'branch': user.get('branch', 'N/A'),
+            'year': str(user.get('year', 'N/A')),
+            'role': role,
+            'entry_date': now.date(),
+            'entry_time': now.time()
+        }
+        with self._lock:
+            self._inside[record['full_reg_no']] = record
+            self._log('entry', record['full_reg_no'], record)
+
+    def exit(self, full_reg_no):
+        with self._lock:
+            if self._inside.pop(str(full_reg_no), None) is not None:
+                self._log('exit', str(full_reg_no))
+
+    def clear(self):
+        with self._lock:
+            self._replace({})
+
+    def get(self, full_reg_no):
+        with self._lock:
+            return self._inside.get(str(full_reg_no))
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._inside.values())
+
+    def count(self):
+        with self._lock:
+            return len(self._inside)
+
+    def wait_for_change(self, version, epoch, timeout):
+        """Block until the registry moves past `version` (or `timeout` passes); True if it did"""
+        with self._lock:
+            return self._lock.wait_for(lambda: self.version != version or self.epoch != epoch, timeout)
+
+    def changes_since(self, version, epoch=None):
+        """Net entries/exits after `version`, or a full snapshot when they are no longer known"""
+        with self._lock:
+            oldest = self._changes[0][0] if self._changes else self.version + 1
+            if epoch != self.epoch or version is None or version > self.version or version < oldest - 1:
+                return {
+                    'epoch': self.epoch,
+                    'version': self.version,
+                    'full': True,
+                    'users': [public_record(r) for r in self._inside.values()],
+                    'currently_inside': len(self._inside)
+                }
+
+            latest = {}
+            for change_version, op, full_reg_no, record in self._changes:
+                if change_version > version:
+                    latest[full_reg_no] = (op, record)
+            return {
+                'epoch': self.epoch,
+                'version': self.version,
+                'full': False,
+                'entered': [public_record(record) for op, record in latest.values() if op == 'entry'],
+                'exited': [key for key, (op, record) in latest.items() if op == 'exit'],
+                'currently_inside': len(self._inside)
+            }
+
+occupancy = OccupancyRegistry()
+
 # --- LOG FUNCTIONS ---
 def get_open_log(full_reg_no):
     """Check if user has an open log (currently inside)"""
+    if occupancy.ensure_loaded():
+        return occupancy.get(full_reg_no)
     query = """SELECT * FROM logs 
-               WHERE full_reg_no = %s AND (exit_date IS NULL OR exit_date = '')"""
+               WHERE full_reg_no = %s AND is_open = 1"""
     return execute_query(query, (str(full_reg_no),), fetch_one=True)
 
 def get_users_inside():
     """Get all users currently inside the library"""
+    if occupancy.ensure_loaded():
+        return occupancy.snapshot()
     query = """SELECT full_reg_no, name FROM logs 
-               WHERE exit_date IS NULL OR exit_date = ''"""
+               WHERE is_open = 1"""
     result = execute_query(query, fetch=True)
     return result or []
 
-def create_entry_log(user, role):
-    """Create new entry log"""
+LIBRARY_OPEN_HOUR = 7
+LIBRARY_CLOSE_HOUR = 20
+
+ENTRY_LOG_QUERY = """INSERT INTO logs
+                     (full_reg_no, name, branch, year, entry_date, entry_time, role)
+                     VALUES (%s, %s, %s, %s, %s, %s, %s)"""
+
+EXIT_LOG_QUERY = """UPDATE logs
+                    SET exit_date = %s, exit_time = %s
+                    WHERE full_reg_no = %s AND is_open = 1"""
+
+def decide_scan(user, role, mode, open_log, now):
+    """Decide whether a scan is an entry or an exit. Returns (action, error)"""
+    if open_log:
+        if mode == 'entry':
+            return None, f"Error: {user['name']} is already inside the library."
+        if open_log['role'] != role:
+            return None, f"Exit denied. You entered as {open_log['role']} and must exit with the same role."
+        return 'exit', None
+
+    if mode == 'exit':
+        return None, f"Error: {user['name']} is not currently inside the library."
+    if now.hour < LIBRARY_OPEN_HOUR or now.hour >= LIBRARY_CLOSE_HOUR:
+        return None, "Library closed. Hours: 7 AM - 8 PM"
+    return 'entry', None
+
+SCAN_LOCK_TIMEOUT = int(os.getenv('SCAN_LOCK_TIMEOUT', '5'))
+
+def scan_user(user, role, mode='toggle'):
+    """Record an entry or exit for a user in a single transaction.
+
+    A MySQL named lock per registration number (GET_LOCK) is held while the
+    open log is read and written, so two quick scans of the same card, on
+    any worker, are serialized and the second one sees the first one's
+    write instead of inserting a duplicate open log. Nothing else takes
+    these locks, so a roster import holding the students/faculty rows does
+    not stall the kiosk. The registry is updated before the lock is
+    released. `mode` is 'toggle', 'entry' or 'exit'.
+    Returns (action, error) where action is 'entry' or 'exit'.
+    """
+    if journal and occupancy.loaded:
+        return journal_scan(user, role, mode)
+
+    full_reg_no = str(user['full_reg_no'])
+    lock_name = f"{DB_CONFIG['database']}.scan.{full_reg_no}"
     now = datetime.now(IST)
-    query = """INSERT INTO logs 
-               (full_reg_no, name, branch, year,  entry_date, entry_time, role) 
-               VALUES (%s, %s, %s, %s, %s, %s, %s)"""
-    
-    values = (
-        str(user['full_reg_no']),
-        user['name'],
-        user.get('branch', 'N/A'),
-        str(user.get('year', 'N/A')),
-        now.date(),
-        now.time(),
-        role
-    )
-    
-    return execute_query(query, values)
+    action, error = None, None
 
-def update_exit_log(full_reg_no):
-    """Update log with exit time"""
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(dictionary=True, buffered=True)
+            try:
+                cursor.execute("SELECT GET_LOCK(%s, %s) AS locked", (lock_name, SCAN_LOCK_TIMEOUT))
+                if cursor.fetchone()['locked'] != 1:
+                    return None, "This card is being scanned elsewhere. Please try again."
+                conn.start_transaction()
+                try:
+                    cursor.execute("""SELECT role FROM logs
+                                      WHERE full_reg_no = %s AND is_open = 1
+                                      LIMIT 1""", (full_reg_no,))
+                    action, error = decide_scan(user, role, mode, cursor.fetchone(), now)
+
+                    if action == 'entry':
+                        cursor.execute(ENTRY_LOG_QUERY,
+                                       (full_reg_no, user['name'], user.get('branch', 'N/A'),
+                                        str(user.get('year', 'N/A')), now.date(), now.time(), role))
+                    elif action == 'exit':
+                        cursor.execute(EXIT_LOG_QUERY, (now.date(), now.time(), full_reg_no))
+
+                    if action:
+                        conn.commit()
+                        # Still under the card's lock, so the registry sees this
+                        # card's scans in the order they were committed
+                        apply_scan(action, user, role, now)
+                    else:
+                        conn.rollback()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+                    cursor.fetchall()
+            finally:
+                cursor.close()
+    except mysql.connector.Error as err:
+        print(f"Scan transaction error: {err}")
+        return None, "Error logging scan. Please try again."
+
+    return action, error
+
+def scan_message(action, user):
+    if action == 'exit':
+        return f"Goodbye! {user['name']} exited the library."
+    return f"Welcome! {user['name']} entered the library."
+
+def apply_scan(action, user, role, now):
+    """Reflect a recorded scan in the in-memory registry and stats"""
+    if action == 'entry':
+        # Stats first, so stream subscribers woken by the registry see both
+        live_stats.record_entry(user['full_reg_no'], now)
+        occupancy.enter(user, role, now)
+    elif action == 'exit':
+        occupancy.exit(user['full_reg_no'])
+
+# --- WRITE-BEHIND JOURNAL ---
+WRITE_BEHIND = os.getenv('KIOSK_WRITE_BEHIND', '0') == '1'
+JOURNAL_PATH = os.getenv('KIOSK_JOURNAL_PATH',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scan_journal.jsonl'))
+JOURNAL_FLUSH_SECONDS = float(os.getenv('KIOSK_JOURNAL_FLUSH_SECONDS', '1'))
+JOURNAL_BATCH_SIZE = int(os.getenv('KIOSK_JOURNAL_BATCH_SIZE', '500'))
+
+class ScanJournal:
+    """Durable local journal of scan events for write-behind mode.
+
+    Each scan is appended and fsynced, then acknowledged straight away; a
+    background thread writes the events to `logs` in batched statements.
+    The last applied sequence number is stored in app_meta in the same
+    transaction as the batch, so events still in the file at restart are
+    replayed exactly once. The registry of the worker that journals a scan
+    decides entry or exit, so only one kiosk worker per host may use the
+    journal: the file is locked for the life of the process and a second
+    process fails to start (serve.py refuses --workers > 1).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta_key = f"scan_journal_seq:{socket.gethostname()}"
+        self._lock_file()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._applied = None
+        self._drop_torn_tail()
+        events = self._read()
+        # Only events already in the file at start can have been applied by an
+        # earlier run; everything appended from now on is applied by this one
+        self._replayed_until = events[-1]['seq'] if events else 0
+        self._last_seq = self._replayed_until
+
+    def _lock_file(self):
+        """Take an exclusive OS lock on <journal>.lock, held until the process exits"""
+        self._lock_handle = open(self.path + '.lock', 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(self._lock_handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self._lock_handle.seek(0)
+                msvcrt.locking(self._lock_handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self._lock_handle.close()
+            raise RuntimeError(f"Scan journal {self.path} is in use by another kiosk process. "
+                               "Write-behind needs a single kiosk worker per host (--workers 1).")
+
+    def _drop_torn_tail(self):
+        """Cut off a half-written last line left by a crash mid-append"""
+        if not self.has_pending():
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b'\n'):
+                print("[JOURNAL] Dropping incomplete last event.")
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def has_pending(self):
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def append(self, event):
+        with self._lock:
+            seq = max(time.time_ns(), self._last_seq + 1)
+            line = json.dumps(dict(event, seq=seq), default=str)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._last_seq = seq
+        return seq
+
+    def _read_applied(self):
+        """Last sequence number already written to MySQL by this host"""
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(buffered=True)
+            cursor.execute("SELECT meta_value FROM app_meta WHERE meta_key = %s", (self.meta_key,))
+            row = cursor.fetchone()
+            cursor.close()
+        return int(row[0]) if row else 0
+
+    def _load_applied(self):
+        """Pick up the applied sequence number stored by an earlier run.
+
+        New sequence numbers are moved past it, and it is capped at the last
+        event found in the file at start, so a clock that has gone back since
+        (NTP step, corrected PC clock) cannot make new events look applied.
+        """
+        applied = self._read_applied()
+        with self._lock:
+            self._last_seq = max(self._last_seq, applied)
+        self._applied = min(applied, self._replayed_until)
+
+    def _write_batch(self, batch):
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            conn.start_transaction()
+            try:
+                for kind, group in itertools.groupby(batch, key=lambda e: e['type']):
+                    group = list(group)
+                    if kind == 'entry':
+                        cursor.executemany(ENTRY_LOG_QUERY, [
+                            (e['full_reg_no'], e['name'], e['branch'], e['year'], e['date'], e['time'], e['role'])
+                            for e in group])
+                    else:
+                        cursor.executemany(EXIT_LOG_QUERY, [(e['date'], e['time'], e['full_reg_no']) for e in group])
+                cursor.execute("""INSERT INTO app_meta (meta_key, meta_value) VALUES (%s, %s)
+                                  ON DUPLICATE KEY UPDATE meta_value = VALUES(meta_value)""",
+                               (self.meta_key, str(batch[-1]['seq'])))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        self._applied = batch[-1]['seq']
+
+    def _compact(self):
+        """Drop applied events from the file"""
+        with self._lock:
+            remaining = [e for e in self._read() if e['seq'] > self._applied]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for event in remaining:
+                    f.write(json.dumps(event, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def flush(self):
+        """Write all journaled events to MySQL. Returns the number written."""
+        with self._flush_lock:
+            if self._applied is None:
+                self._load_applied()
+            events = self._read()
+            if not events:
+                return 0
+
+            todo = [e for e in events if e['seq'] > self._applied]
+            for start in range(0, len(todo), JOURNAL_BATCH_SIZE):
+                self._write_batch(todo[start:start + JOURNAL_BATCH_SIZE])
+            self._compact()
+            return len(todo)
+
+    def _run(self):
+        while not self._stop.wait(JOURNAL_FLUSH_SECONDS):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[JOURNAL] Flush failed, will retry: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='scan-journal-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher and make a last attempt to write pending events"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=JOURNAL_FLUSH_SECONDS * 2)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[JOURNAL] Final flush failed, events will be replayed at restart: {e}")
+
+# Opened by warm_up(), in the process that serves requests: with the debug
+# reloader the parent process imports this module too and must not take the lock
+journal = None
+_journal_scan_lock = threading.Lock()
+
+def open_journal():
+    """Open and lock the write-behind journal (KIOSK_WRITE_BEHIND=1)"""
+    global journal
+    if WRITE_BEHIND and journal is None:
+        journal = ScanJournal(JOURNAL_PATH)
+    return journal
+
+def journal_paused():
+    """Hold off journal scans for a block that rebuilds state from MySQL (no-op without write-behind)"""
+    return _journal_scan_lock if journal else nullcontext()
+
+def journal_scan(user, role, mode='toggle'):
+    """Write-behind variant of scan_user: decide from the registry and journal the event"""
+    full_reg_no = str(user['full_reg_no'])
     now = datetime.now(IST)
-    query = """UPDATE logs 
-               SET exit_date = %s, exit_time = %s 
-               WHERE full_reg_no = %s AND (exit_date IS NULL OR exit_date = '')"""
-    
-    return execute_query(query, (now.date(), now.time(), str(full_reg_no)))
+    with _journal_scan_lock:
+        action, error = decide_scan(user, role, mode, occupancy.get(full_reg_no), now)
+        if error:
+            return None, error
+        journal.append({
+            'type': action,
+            'full_reg_no': full_reg_no,
+            'name': user['name'],
+            'branch': user.get('branch', 'N/A'),
+            'year': str(user.get('year', 'N/A')),
+            'role': role,
+            'date': now.date().isoformat(),
+            'time': now.time().isoformat()
+        })
+        apply_scan(action, user, role, now)
+    return action, None
 
 def check_password(user_id, password):
     """Check login credentials"""
@@ -141,118 +844,388 @@ def check_password(user_id, password):
     result = execute_query(query, (user_id, password), fetch_one=True)
     return bool(result)
 
-def get_live_stats():
-    today = datetime.now(IST).date()
+# --- LIVE STATS ---
+def format_hour(hour):
+    """24h hour number -> '9 AM' style label"""
+    if hour == 0:
+        return "12 AM"
+    elif hour < 12:
+        return f"{hour} AM"
+    elif hour == 12:
+        return "12 PM"
+    return f"{hour - 12} PM"
+
+class LiveStats:
+    """Today's entry counters, kept in process so /api/stats needs no query.
+
+    Seeded from the day's logs at startup, updated on every entry and
+    rolled over to zero when the IST date changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, day):
+        self.day = day
+        self.total_entries = 0
+        self.visitors = set()
+        self.hourly = [0] * 24
+
+    def _roll_over(self, today):
+        if self.day != today:
+            self._reset(today)
+
+    def seed(self):
+        """Rebuild today's counters from the logs table"""
+        with journal_paused():
+            if journal and journal.has_pending():
+                return False
+            today = datetime.now(IST).date()
+            query = "SELECT full_reg_no, HOUR(entry_time) AS hour FROM logs WHERE entry_date = %s"
+            rows = execute_query(query, (today,), fetch=True)
+            if rows is None:
+                return False
+            with self._lock:
+                self._reset(today)
+                for row in rows:
+                    self.total_entries += 1
+                    self.visitors.add(str(row['full_reg_no']))
+                    if row['hour'] is not None:
+                        self.hourly[int(row['hour'])] += 1
+        return True
+
+    def record_entry(self, full_reg_no, now):
+        with self._lock:
+            self._roll_over(now.date())
+            self.total_entries += 1
+            self.visitors.add(str(full_reg_no))
+            self.hourly[now.hour] += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._roll_over(datetime.now(IST).date())
+            total_entries = self.total_entries
+            unique_visitors = len(self.visitors)
+            # Busiest hour, latest one wins a tie
+            peak = max(range(24), key=lambda h: (self.hourly[h], h))
+            peak_count = self.hourly[peak]
+
+        return {
+            "total_entries_today": total_entries,
+            "unique_visitors_today": unique_visitors,
+            "peak_hour_today": format_hour(peak) if peak_count else "N/A"
+        }
+
+live_stats = LiveStats()
 
-    total_entries_query = "SELECT COUNT(*) as count FROM logs WHERE entry_date = %s"
-    total_entries_result = execute_query(total_entries_query, (today,), fetch_one=True)
-    total_entries_today = total_entries_result['count'] if total_entries_result else 0
-    print("total_entries_result:", total_entries_result)
-
-    unique_visitors_query = "SELECT COUNT(DISTINCT full_reg_no) as count FROM logs WHERE entry_date = %s"
-    unique_visitors_result = execute_query(unique_visitors_query, (today,), fetch_one=True)
-    unique_visitors_today = unique_visitors_result['count'] if unique_visitors_result else 0
-    print("unique_visitors_result:", unique_visitors_result)
-
-    inside_query = "SELECT COUNT(*) as count FROM logs WHERE exit_date IS NULL OR exit_date = ''"
-    inside_result = execute_query(inside_query, fetch_one=True)
-    currently_inside = inside_result['count'] if inside_result else 0
-    print("inside_result:", inside_result)
-
-    peak_hour_query = """SELECT HOUR(entry_time) as hour, COUNT(id) as count
-                         FROM logs WHERE entry_date = %s
-                         GROUP BY HOUR(entry_time) ORDER BY count DESC, hour DESC LIMIT 1"""
-    peak_hour_result = execute_query(peak_hour_query, (today,), fetch_one=True)
-    print("peak_hour_result:", peak_hour_result)
-    peak_hour_str = "N/A"
-    if peak_hour_result and peak_hour_result['hour'] is not None:
-        hour = int(peak_hour_result['hour'])
-        if hour == 0:
-            peak_hour_str = "12 AM"
-        elif hour < 12:
-            peak_hour_str = f"{hour} AM"
-        elif hour == 12:
-            peak_hour_str = "12 PM"
-        else:
-            peak_hour_str = f"{hour - 12} PM"
+def get_live_stats():
+    stats = live_stats.snapshot()
+    occupancy.ensure_loaded()
+    stats["currently_inside"] = occupancy.count()
+    return stats
+
+# --- QUERY STATS ---
+def flush_query_stats():
+    """Add this worker's statement timings to the shared query_stats table"""
+    try:
+        with db_pool.connection() as conn:
+            return profiler.flush(conn)
+    except mysql.connector.Error as err:
+        print(f"Could not store query stats: {err}")
+        return 0
+
+# --- BACKGROUND JOBS ---
+JOB_HISTORY_SIZE = int(os.getenv('JOB_HISTORY_SIZE', '100'))
+# How late a scheduled run may still start (APScheduler misfire_grace_time)
+JOB_MISFIRE_GRACE_SECONDS = int(os.getenv('JOB_MISFIRE_GRACE_SECONDS', '30'))
+
+def ensure_job_runs_table():
+    """Create the table holding the run history of shared jobs, or add the tick claim to an older one"""
+    query = """CREATE TABLE IF NOT EXISTS job_runs (
+                   id INT AUTO_INCREMENT PRIMARY KEY,
+                   job_name VARCHAR(64) NOT NULL,
+                   scheduled_at DATETIME NULL,
+                   worker VARCHAR(128),
+                   started_at DATETIME NOT NULL,
+                   duration_ms INT,
+                   affected_rows INT,
+                   status VARCHAR(16),
+                   error TEXT,
+                   KEY idx_job_runs_name (job_name, started_at),
+                   UNIQUE KEY idx_job_runs_tick (job_name, scheduled_at)
+               )"""
+    if execute_query(query) is None:
+        return None
+    # A table created before the tick claim has no scheduled_at (migration 005)
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(buffered=True)
+            migrate.m005_job_run_ticks(cursor)
+            cursor.close()
+        return True
+    except mysql.connector.Error as err:
+        print(f"Could not add the tick claim to job_runs: {err}")
+        return None
 
-    return {
-        "total_entries_today": total_entries_today,
-        "unique_visitors_today": unique_visitors_today,
-        "currently_inside": currently_inside,
-        "peak_hour_today": peak_hour_str
-    }
+class JobRunner:
+    """The kiosk's single background scheduler.
+
+    Jobs marked `exclusive` take a MySQL named lock (GET_LOCK) for the
+    duration of the run, so two runs never overlap. A scheduled run also
+    claims its tick first by inserting (job, scheduled time) into job_runs,
+    which is unique: with several workers up only the first one runs the
+    job for that tick, even if it has finished before another worker's
+    scheduler fires. Per-process cache refreshes are registered with
+    exclusive=False since every worker needs them.
+    Every run is kept in memory; exclusive runs are also written to
+    job_runs with their duration and affected-row count.
+    """
+
+    def __init__(self):
+        self.scheduler = BackgroundScheduler(timezone=IST)
+        self._jobs = {}
+        self._history = deque(maxlen=JOB_HISTORY_SIZE)
+        self._lock = threading.Lock()
+
+    def register(self, name, func, trigger, exclusive=True, **trigger_args):
+        self._jobs[name] = {'func': func, 'exclusive': exclusive, 'trigger': trigger, 'trigger_args': trigger_args}
+        self.scheduler.add_job(self._fire, trigger=trigger, args=[name], id=name,
+                               replace_existing=True, coalesce=True,
+                               misfire_grace_time=JOB_MISFIRE_GRACE_SECONDS, **trigger_args)
+
+    def _fire(self, name):
+        """Scheduler entry point: run the job for the tick that just fired"""
+        scheduled_at = None
+        if self._jobs[name]['exclusive']:
+            # The tick is the first fire time within the grace period before now
+            now = datetime.now(IST)
+            trigger = self.scheduler.get_job(name).trigger
+            scheduled_at = trigger.get_next_fire_time(None, now - timedelta(seconds=JOB_MISFIRE_GRACE_SECONDS))
+        return self.run(name, scheduled_at=scheduled_at)
+
+    def _claim(self, cursor, name, started, scheduled_at):
+        """Insert the job_runs row of a scheduled tick; None if another worker has it"""
+        try:
+            cursor.execute("""INSERT INTO job_runs (job_name, scheduled_at, worker, started_at, status)
+                              VALUES (%s, %s, %s, %s, 'running')""",
+                           (name, scheduled_at.replace(tzinfo=None), WORKER_ID, started.replace(tzinfo=None)))
+        except mysql.connector.errors.IntegrityError as err:
+            if err.errno != errorcode.ER_DUP_ENTRY:
+                raise
+            return None
+        except mysql.connector.errors.ProgrammingError as err:
+            # Not "claimed elsewhere": without the claim the job would never run again
+            raise RuntimeError(f"job_runs cannot record tick claims, apply the migrations "
+                               f"(python migrate.py): {err}") from err
+        return cursor.lastrowid
+
+    def _record(self, name, started, status, affected=None, error=None, persist=False, run_id=None):
+        entry = {
+            'job': name,
+            'worker': WORKER_ID,
+            'started_at': started.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_ms': int((datetime.now(IST) - started).total_seconds() * 1000),
+            'affected_rows': affected,
+            'status': status,
+            'error': error
+        }
+        with self._lock:
+            self._history.append(entry)
+        if run_id:
+            execute_query("""UPDATE job_runs
+                             SET duration_ms = %s, affected_rows = %s, status = %s, error = %s
+                             WHERE id = %s""",
+                          (entry['duration_ms'], affected, status, error, run_id))
+        elif persist:
+            execute_query("""INSERT INTO job_runs
+                             (job_name, worker, started_at, duration_ms, affected_rows, status, error)
+                             VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                          (name, WORKER_ID, started.replace(tzinfo=None), entry['duration_ms'],
+                           affected, status, error))
+        return entry
+
+    def _run_locked(self, name, func, started, scheduled_at=None, **kwargs):
+        lock_name = f"{DB_CONFIG['database']}.job.{name}"
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(buffered=True)
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (lock_name,))
+            if cursor.fetchone()[0] != 1:
+                cursor.close()
+                return self._record(name, started, 'skipped')
+            try:
+                run_id = None
+                if scheduled_at is not None:
+                    run_id = self._claim(cursor, name, started, scheduled_at)
+                    if run_id is None:
+                        return self._record(name, started, 'skipped')
+                try:
+                    affected = func(**kwargs)
+                except Exception as e:
+                    print(f"[JOB ERROR] {name}: {e}")
+                    return self._record(name, started, 'error', error=str(e), persist=True, run_id=run_id)
+                return self._record(name, started, 'ok', affected=affected, persist=True, run_id=run_id)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+                cursor.fetchall()
+                cursor.close()
+
+    def run(self, name, scheduled_at=None, **kwargs):
+        """Run a registered job now; `scheduled_at` is the tick when the scheduler fired it"""
+        job = self._jobs[name]
+        started = datetime.now(IST)
+        try:
+            with query_profiler.label(f'job:{name}'):
+                if job['exclusive']:
+                    return self._run_locked(name, job['func'], started, scheduled_at, **kwargs)
+                return self._record(name, started, 'ok', affected=job['func'](**kwargs))
+        except Exception as e:
+            print(f"[JOB ERROR] {name}: {e}")
+            return self._record(name, started, 'error', error=str(e), persist=job['exclusive'])
+
+    def start(self):
+        if not self.scheduler.running:
+            self.scheduler.start()
+            atexit.register(self.shutdown)
+
+    def shutdown(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+
+    def status(self):
+        with self._lock:
+            history = list(self._history)
+        jobs = []
+        for name, job in self._jobs.items():
+            scheduled = self.scheduler.get_job(name)
+            jobs.append({
+                'job': name,
+                'exclusive': job['exclusive'],
+                'trigger': str(scheduled.trigger) if scheduled else job['trigger'],
+                'next_run': str(scheduled.next_run_time) if scheduled and scheduled.next_run_time else None
+            })
+        return {'worker': WORKER_ID, 'jobs': jobs, 'history': history[::-1]}
+
+jobs = JobRunner()
+
+# --- AUTO EXIT ---
+AUTO_EXIT_TIMES = os.getenv('AUTO_EXIT_TIMES', '16:30,22:54')
 
-# --- AUTO EXIT SCHEDULER ---
 def auto_exit_users():
-    """Automatically log out users still inside at 16:30 IST"""
-    try:
+    """Automatically log out users still inside at the auto-exit time"""
+    # A scan journaled between the flush and the UPDATE would be wiped by clear()
+    with journal_paused():
+        if journal:
+            journal.flush()
         now = datetime.now(IST)
         query = """UPDATE logs 
                    SET exit_date = %s, exit_time = %s 
-                   WHERE exit_date IS NULL OR exit_date = ''"""
-        
-        count = execute_query(query, (now.date(), now.time()))
-        if count and count > 0:
-            print(f"[AUTO-EXIT] {count} users exited automatically at 16:30 IST.")
-        else:
-            print("[AUTO-EXIT] No open logs found at 16:30 IST.")
-    except Exception as e:
-        print(f"[AUTO-EXIT ERROR] {e}")
+                   WHERE is_open = 1"""
 
-# Schedule auto_exit_users to run every day at 16:30 IST
-scheduler = BackgroundScheduler(timezone=IST)
-scheduler.add_job(auto_exit_users, trigger='cron', hour=22, minute=54, id='auto_exit_job')
-scheduler.start()
-atexit.register(lambda: scheduler.shutdown())
+        count = execute_query(query, (now.date(), now.time()))
+        if count is not None:
+            occupancy.clear()
+    if count and count > 0:
+        print(f"[AUTO-EXIT] {count} users exited automatically at {now:%H:%M} IST.")
+    else:
+        print(f"[AUTO-EXIT] No open logs found at {now:%H:%M} IST.")
+    return count
 
-# Run startup cleanup    
-def run_startup_cleanup():
-    """Cleanup leftover logs from previous days or after auto-exit cutoff."""
-    try:
-        now = datetime.now(IST)
-        today = now.date()
-        
-        # Check if there are any open logs from before today
-        query = """SELECT COUNT(*) as count FROM logs 
-                   WHERE (exit_date IS NULL OR exit_date = '') 
-                   AND entry_date < %s"""
-        old_open_logs = execute_query(query, (today,), fetch_one=True)
-
-        if old_open_logs and old_open_logs['count'] > 0:
-            print("[STARTUP CLEANUP] Found old open logs from previous days. Running auto-exit...")
-            auto_exit_users()
-        else:
-            print("[STARTUP CLEANUP] No old logs found. Skipping cleanup.")
-    except Exception as e:
-        print(f"[STARTUP CLEANUP ERROR] {e}")
-    return None
+def run_startup_cleanup(force=False):
+    """Cleanup leftover logs from previous days, at most once per day."""
+    today = datetime.now(IST).date()
+    if not force and get_meta('startup_cleanup_date') == str(today):
+        return 0
+
+    # Check if there are any open logs from before today
+    query = """SELECT COUNT(*) as count FROM logs 
+               WHERE is_open = 1 
+               AND entry_date < %s"""
+    old_open_logs = execute_query(query, (today,), fetch_one=True)
+    if old_open_logs is None:
+        raise RuntimeError("could not check for open logs from previous days")
+
+    count = 0
+    if old_open_logs['count'] > 0:
+        print("[STARTUP CLEANUP] Found old open logs from previous days. Running auto-exit...")
+        count = auto_exit_users()
+    else:
+        print("[STARTUP CLEANUP] No old logs found. Skipping cleanup.")
+    set_meta('startup_cleanup_date', today)
+    return count
 
-# Initialize scheduler
+# Register all background jobs (started by warm_up)
 try:
-    scheduler = BackgroundScheduler(timezone=IST)
-    scheduler.add_job(auto_exit_users, trigger='cron', hour=16, minute=30, id='auto_exit_job')
-    scheduler.start()
-    atexit.register(lambda: scheduler.shutdown())
+    for exit_time in AUTO_EXIT_TIMES.split(','):
+        hour, minute = exit_time.strip().split(':')
+        jobs.register(f'auto_exit_{hour}{minute}', auto_exit_users, 'cron', hour=int(hour), minute=int(minute))
+    jobs.register('startup_cleanup', run_startup_cleanup, 'cron', hour=0, minute=5)
+    jobs.register('roster_refresh', roster.refresh_if_changed, 'interval', exclusive=False, seconds=ROSTER_REFRESH_SECONDS)
+    jobs.register('occupancy_reconcile', occupancy.reconcile, 'interval', exclusive=False, seconds=OCCUPANCY_RECONCILE_SECONDS)
+    jobs.register('live_stats_seed', live_stats.seed, 'interval', exclusive=False, seconds=OCCUPANCY_RECONCILE_SECONDS)
+    jobs.register('live_stats_midnight', live_stats.seed, 'cron', exclusive=False, hour=0, minute=0)
+    jobs.register('query_stats_flush', flush_query_stats, 'interval', exclusive=False, seconds=QUERY_STATS_FLUSH_SECONDS)
 except Exception as e:
     print(f"Scheduler initialization error: {e}")
 
+# --- STARTUP / SHUTDOWN ---
+DB_POOL_WARM = int(os.getenv('DB_POOL_WARM', '2'))
+_warmed_up = False
+
+def warm_up():
+    """Prepare this process before it accepts traffic: open pooled connections,
+    replay the scan journal, load the roster index, occupancy and live stats,
+    and start the background jobs. Raises (the kiosk must not start) if the
+    schema migrations cannot be applied."""
+    global _warmed_up
+    if _warmed_up:
+        return
+    migrate.ensure_current(DB_CONFIG)
+    _warmed_up = True
+
+    db_pool.warm(DB_POOL_WARM)
+    ensure_meta_table()
+    ensure_job_runs_table()
+    if open_journal():
+        try:
+            replayed = journal.flush()
+            if replayed:
+                print(f"[JOURNAL] Replayed {replayed} unflushed scan events.")
+        except Exception as e:
+            print(f"[JOURNAL] Replay failed, will retry in the background: {e}")
+        journal.start()
+    jobs.run('startup_cleanup')
+    roster.load()
+    occupancy.rebuild()
+    live_stats.seed()
+    jobs.start()
+
+def shutdown():
+    """Stop background jobs and flush pending scan events (graceful worker exit)"""
+    jobs.shutdown()
+    if journal:
+        journal.stop()
+    flush_query_stats()
+
 # --- ROUTES ---
 @app.route('/')
 def index():
     """Main page showing current users and entry form"""
     try:
+        # Read the version first: a change racing the snapshot is re-sent, never lost
+        occupancy_version = occupancy.version
         users_inside = get_users_inside()
         messages = get_flashed_messages(with_categories=True)
         toast_message, toast_type = ('', 'info')
         if messages:
             toast_type, toast_message = messages[0]
         
-        run_startup_cleanup()
         return render_template('index.html', 
                              toast_message=toast_message, 
                              toast_type=toast_type, 
-                             users_inside=users_inside)
+                             users_inside=users_inside,
+                             occupancy_version=occupancy_version,
+                             occupancy_epoch=occupancy.epoch)
     except Exception as e:
         print(f"Index route error: {e}")
         return f"<h1>Error loading page</h1><p>{str(e)}</p><p>Check terminal for details.</p>"
@@ -275,31 +1248,13 @@ def check_user():
             flash(error, "error")
             return redirect(url_for('index'))
 
-        now = datetime.now(IST)
-
-        # Check if user currently inside (open log)
-        open_log = get_open_log(user['full_reg_no'])
-
-        if open_log:
-            # User inside → handle exit
-            if open_log['role'] != role:
-                flash(f"Exit denied. You entered as {open_log['role']} and must exit with the same role.", "error")
-                return redirect(url_for('index'))
-
-            update_exit_log(user['full_reg_no'])
-            flash(f"Goodbye! {user['name']} exited the library.", "success")
-            return redirect(url_for('index'))
+        # Entry if outside, exit if inside - decided and written in one transaction
+        action, error = scan_user(user, role)
+        if error:
+            flash(error, "error")
         else:
-            
-
-            # Check library timing
-            if now.hour < 7 or now.hour >= 20:
-                flash("Library closed. Hours: 7 AM - 8 PM", "error")
-                return redirect(url_for('index'))
-
-            create_entry_log(user, role)
-            flash(f"Welcome! {user['name']} entered the library.", "success")
-            return redirect(url_for('index'))
+            flash(scan_message(action, user), "success")
+        return redirect(url_for('index'))
 
     except Exception as e:
         print(f"Error in /check route: {e}")
@@ -331,6 +1286,104 @@ def check_status():
     })
 
 
+@app.route('/api/occupancy', methods=['GET'])
+def api_occupancy():
+    """Entries/exits since the client's version (?since=&epoch=), or a full snapshot"""
+    occupancy.ensure_loaded()
+    since = request.args.get('since', type=int)
+    response = jsonify(occupancy.changes_since(since, request.args.get('epoch')))
+    # The Admin dashboard (another port) reads this feed too
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+# Server-Sent Events: each open stream holds a server thread, so keep the cap
+# below the worker's thread count (serve.py --threads)
+STREAM_HEARTBEAT_SECONDS = int(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', '4'))
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CLIENTS)
+
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Event"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+@app.route('/api/stream', methods=['GET'])
+def api_stream():
+    """Push occupancy deltas and live stats as scans happen.
+
+    Event ids are "<epoch>:<version>"; a reconnecting EventSource sends the
+    last one back (Last-Event-ID) and gets just the changes it missed.
+    """
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({"error": "Too many live streams, poll /api/occupancy instead."}), 503
+
+    # First connect: the version the page was rendered with (?since=&epoch=)
+    last_event_id = request.headers.get('Last-Event-ID') or f"{request.args.get('epoch', '')}:{request.args.get('since', '')}"
+    epoch, _, version = last_event_id.rpartition(':')
+    version = int(version) if version.isdigit() else None
+    occupancy.ensure_loaded()
+
+    def generate(epoch, version):
+        yield "retry: 3000\n\n"
+        while True:
+            feed = occupancy.changes_since(version, epoch)
+            if feed['full'] or feed['entered'] or feed['exited']:
+                feed['stats'] = get_live_stats()
+                yield sse_event('occupancy', feed, f"{feed['epoch']}:{feed['version']}")
+            epoch, version = feed['epoch'], feed['version']
+            if not occupancy.wait_for_change(version, epoch, STREAM_HEARTBEAT_SECONDS):
+                yield ": heartbeat\n\n"
+
+    response = Response(generate(epoch, version), mimetype='text/event-stream')
+    # Runs when the server closes the response, i.e. when the client goes away
+    response.call_on_close(stream_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+@app.route('/api/scan', methods=['POST'])
+def api_scan():
+    """Validate and toggle a scan in one request; returns the outcome and occupancy delta"""
+    try:
+        registry_code = request.form.get('registry_last_digits', '').strip()
+        role = request.form.get('role', '').strip()
+
+        if not role:
+            return jsonify({"success": False, "error": "Please select a role."})
+
+        user, error = find_user_and_validate(registry_code, role)
+        if error:
+            return jsonify({"success": False, "error": error})
+
+        action, error = scan_user(user, role)
+        if error:
+            return jsonify({"success": False, "error": error})
+
+        row = {"full_reg_no": str(user['full_reg_no']), "name": user['name']}
+        return jsonify({
+            "success": True,
+            "action": action,
+            "message": scan_message(action, user),
+            "user_name": user['name'],
+            "occupancy": {
+                "entered": [row] if action == 'entry' else [],
+                "exited": [row["full_reg_no"]] if action == 'exit' else [],
+                "currently_inside": occupancy.count()
+            },
+            "stats": get_live_stats()
+        })
+
+    except Exception as e:
+        print(f"Error in /api/scan route: {e}")
+        traceback.print_exc()
+        return jsonify({"success": False, "error": "An unexpected error occurred. Please try again."}), 500
+
+
 @app.route('/entry', methods=['POST'])
 def handle_entry():
     """Handle library entry (when user is outside)"""
@@ -349,24 +1402,12 @@ def handle_entry():
             flash(error, "error")
             return redirect(url_for('index'))
 
-        # Check library hours
-        now = datetime.now(IST)
-        if now.hour < 7 or now.hour >= 20:
-            flash("Library closed. Active Hours: 7 AM - 8 PM", "error")
-            return redirect(url_for('index'))
-
-        # Check if user is already inside
-        open_log = get_open_log(user['full_reg_no'])
-        if open_log:
-            flash(f"Error: {user['name']} is already inside the library.", "error")
-            return redirect(url_for('index'))
-
-        # Create entry log
-        result = create_entry_log(user, role)
-        if result:
-            flash(f"Welcome! {user['name']} entered the library.", "success")
+        # Check hours and that the user is outside, then create the entry log
+        action, error = scan_user(user, role, mode='entry')
+        if error:
+            flash(error, "error")
         else:
-            flash("Error logging entry. Please try again.", "error")
+            flash(f"Welcome! {user['name']} entered the library.", "success")
 
         return redirect(url_for('index'))
         
@@ -393,23 +1434,12 @@ def handle_exit():
             flash(error, "error")
             return redirect(url_for('index'))
 
-        # Find open log
-        open_log = get_open_log(user['full_reg_no'])
-        if not open_log:
-            flash(f"Error: {user['name']} is not currently inside the library.", "error")
-            return redirect(url_for('index'))
-
-        # Check role consistency
-        if open_log['role'] != role:
-            flash(f"Exit denied. Entered as {open_log['role']}, must exit with same role.", "error")
-            return redirect(url_for('index'))
-
-        # Update exit log
-        result = update_exit_log(user['full_reg_no'])
-        if result:
-            flash(f"Goodbye! {user['name']} exited the library.", "success")
+        # Check the user is inside with the same role, then close the open log
+        action, error = scan_user(user, role, mode='exit')
+        if error:
+            flash(error, "error")
         else:
-            flash("Error logging exit. Please try again.", "error")
+            flash(f"Goodbye! {user['name']} exited the library.", "success")
 
         return redirect(url_for('index'))
         
@@ -459,14 +1489,25 @@ def api_stats():
             "error": str(e)
         }), 500
 
+@app.route('/api/pool-stats', methods=['GET'])
+def api_pool_stats():
+    """Return connection pool counters (borrowed, waiting, created, broken)"""
+    return jsonify(db_pool.stats())
+
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    """Registered background jobs and their recent runs in this worker"""
+    return jsonify(jobs.status())
+
 @app.route('/startup-cleanup')
 def startup_cleanup_route():
     """Route to trigger startup cleanup manually."""
-    try:
-        run_startup_cleanup()
-        return "<h1>Startup cleanup completed.</h1>"
-    except Exception as e:
-        return f"<h1>Error during cleanup:</h1><p>{str(e)}</p>", 500
+    run = jobs.run('startup_cleanup', force=True)
+    if run['status'] == 'error':
+        return f"<h1>Error during cleanup:</h1><p>{run['error']}</p>", 500
+    if run['status'] == 'skipped':
+        return "<h1>Startup cleanup is already running in another worker.</h1>"
+    return "<h1>Startup cleanup completed.</h1>"
 
 
 # --- STATIC FILES ---
@@ -513,4 +1554,7 @@ def not_found(error):
 if __name__ == '__main__':
     print("Starting Library Management System...")
     print("Visit: http://localhost:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    if not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_up()
+    app.run(debug=DEBUG, host='0.0.0.0', port=5000)
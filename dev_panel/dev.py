@@ -13,14 +13,18 @@ DB_USER = 'root'  # Replace with your MySQL username
 DB_PASSWORD = ''  # Replace with your MySQL password
 DB_NAME = 'lib_main'
 
-# Define the secure root directory
-LIB2_PATH = Path('C:\\xampp\\htdocs\\lib2').resolve()
+# Define the secure root directory (LIB2_PATH overrides it, e.g. on Linux)
+LIB2_PATH = Path(os.getenv('LIB2_PATH', 'C:\\xampp\\htdocs\\lib2')).resolve()
 if not LIB2_PATH.is_dir():
     LIB2_PATH.mkdir()
 
 app = Flask(__name__)
 app.secret_key = 'super_secret_key'
 
+# Debug mode (and the reloader) only when explicitly asked for: APP_DEBUG=1
+DEBUG = os.getenv('APP_DEBUG', '0') == '1'
+app.config['DEBUG'] = DEBUG
+
 # Simple path validation helper
 def validate_path(requested_path):
     path = Path(LIB2_PATH, requested_path).resolve()
@@ -190,4 +194,4 @@ def run_command():
         })
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5002)
+    app.run(debug=DEBUG, host='0.0.0.0', port=5002)
@@ -0,0 +1,273 @@
+"""Versioned schema migrations for the library database (lib_main).
+
+    python migrate.py            apply pending migrations
+    python migrate.py status     list applied and pending versions
+    python migrate.py check      EXPLAIN the hot queries, fail if one skips its index
+
+Applied versions are recorded in schema_migrations. Every migration checks
+information_schema before changing anything, so it can be re-run safely on
+a database that was partly patched by hand. serve.py applies pending
+migrations before it starts an app, and each app's warm_up() runs
+ensure_current(), refusing to start on a schema it cannot bring up to date.
+"""
+import os
+import sys
+import mysql.connector
+
+# Same environment variables as the Admin app
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASS", ""),
+    "database": os.getenv("DB_NAME", "lib_main")
+}
+
+# ---------------------- Helpers ----------------------
+def table_exists(cur, table):
+    cur.execute("""
+        SELECT 1 FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return cur.fetchone() is not None
+
+def column_type(cur, table, column):
+    cur.execute("""
+        SELECT DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    row = cur.fetchone()
+    return row[0].lower() if row else None
+
+def add_column(cur, table, column, definition):
+    if column_type(cur, table, column) is None:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def has_index(cur, table, name):
+    cur.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1
+    """, (table, name))
+    return cur.fetchone() is not None
+
+def add_index(cur, table, name, columns, unique=False):
+    if not has_index(cur, table, name):
+        cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})")
+
+def drop_index(cur, table, name):
+    if has_index(cur, table, name):
+        cur.execute(f"DROP INDEX {name} ON {table}")
+
+def is_indexed(cur, table, column):
+    """True if some index starts with `column`"""
+    cur.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1
+        LIMIT 1
+    """, (table, column))
+    return cur.fetchone() is not None
+
+# ---------------------- Migrations ----------------------
+def m001_logs_lookup_columns(cur):
+    """Indexed open-log flag and registration suffix columns on logs"""
+    # Same meaning as the old `exit_date IS NULL OR exit_date = ''`: an empty
+    # string in a text column, or a zero date when '' was stored in a DATE
+    if column_type(cur, "logs", "exit_date") in ("date", "datetime", "timestamp"):
+        open_expr = "exit_date IS NULL OR exit_date < '1000-01-01'"
+    else:
+        open_expr = "exit_date IS NULL OR exit_date = ''"
+    add_column(cur, "logs", "is_open", f"TINYINT(1) AS ({open_expr}) STORED")
+    add_column(cur, "logs", "reg_suffix5", "CHAR(5) AS (RIGHT(full_reg_no, 5)) STORED")
+    add_column(cur, "logs", "reg_suffix4", "CHAR(4) AS (RIGHT(full_reg_no, 4)) STORED")
+    add_index(cur, "logs", "idx_logs_open", "is_open, full_reg_no")
+    add_index(cur, "logs", "idx_logs_entry", "entry_date, entry_time")
+    add_index(cur, "logs", "idx_logs_suffix5", "reg_suffix5, role, entry_date")
+    add_index(cur, "logs", "idx_logs_suffix4", "reg_suffix4, role, entry_date")
+
+def m002_roster_lookup_columns(cur):
+    """Student suffix lookups and the faculty code join"""
+    add_column(cur, "students", "reg_suffix5", "CHAR(5) AS (RIGHT(full_reg_no, 5)) STORED")
+    add_index(cur, "students", "idx_students_suffix5", "reg_suffix5")
+    if not is_indexed(cur, "faculty", "full_reg_no"):
+        add_index(cur, "faculty", "idx_faculty_reg_no", "full_reg_no")
+
+def m003_history_keyset_indexes(cur):
+    """User history pages read newest-first straight off the suffix indexes"""
+    # InnoDB appends the primary key (id), the last keyset column
+    add_index(cur, "logs", "idx_logs_suffix5_time", "reg_suffix5, role, entry_date, entry_time")
+    add_index(cur, "logs", "idx_logs_suffix4_time", "reg_suffix4, role, entry_date, entry_time")
+    # Prefixes of the new ones
+    drop_index(cur, "logs", "idx_logs_suffix5")
+    drop_index(cur, "logs", "idx_logs_suffix4")
+
+def m004_logs_archive(cur):
+    """Archive table for closed logs past the retention age (Admin's archive job)"""
+    # Same columns, generated columns and indexes as logs at this point; later
+    # migrations that change logs must change logs_archive too
+    cur.execute("CREATE TABLE IF NOT EXISTS logs_archive LIKE logs")
+
+def m005_job_run_ticks(cur):
+    """One job_runs row per scheduled tick of a kiosk job, so only one worker runs it"""
+    # The kiosk creates job_runs with these already when it does not exist yet
+    if not table_exists(cur, "job_runs"):
+        return
+    add_column(cur, "job_runs", "scheduled_at", "DATETIME NULL AFTER job_name")
+    add_index(cur, "job_runs", "idx_job_runs_tick", "job_name, scheduled_at", unique=True)
+
+def m006_import_job_heartbeat(cur):
+    """Heartbeat of import jobs, so ones whose worker died are reported as failed"""
+    # The Admin app creates import_jobs with it when it does not exist yet
+    if table_exists(cur, "import_jobs"):
+        add_column(cur, "import_jobs", "heartbeat_at", "DATETIME NULL AFTER finished_at")
+
+MIGRATIONS = [
+    (1, "logs open flag and registration suffix columns", m001_logs_lookup_columns),
+    (2, "students suffix column and faculty code index", m002_roster_lookup_columns),
+    (3, "history keyset indexes on the suffix columns", m003_history_keyset_indexes),
+    (4, "logs_archive table", m004_logs_archive),
+    (5, "job_runs scheduled tick claim", m005_job_run_ticks),
+    (6, "import_jobs heartbeat", m006_import_job_heartbeat),
+]
+
+# ---------------------- Runner ----------------------
+def ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def applied_versions(cur):
+    ensure_migrations_table(cur)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+def apply_pending(config=DB_CONFIG):
+    """Apply every migration not yet in schema_migrations; returns the versions applied"""
+    conn = mysql.connector.connect(**config)
+    cur = conn.cursor(buffered=True)
+    lock = f"{config['database']}.schema_migrations"
+    applied = []
+    try:
+        # Several workers or apps may start at once; one of them migrates
+        cur.execute("SELECT GET_LOCK(%s, 120)", (lock,))
+        if cur.fetchone()[0] != 1:
+            raise RuntimeError("timed out waiting for another migration run")
+        try:
+            done = applied_versions(cur)
+            for version, name, migration in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"[MIGRATE] {version:03d} {name}")
+                migration(cur)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+                applied.append(version)
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (lock,))
+            cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+    return applied
+
+def pending_versions(config=DB_CONFIG):
+    conn = mysql.connector.connect(**config)
+    cur = conn.cursor(buffered=True)
+    try:
+        done = applied_versions(cur)
+    finally:
+        cur.close()
+        conn.close()
+    return [version for version, _, _ in MIGRATIONS if version not in done]
+
+def status(config=DB_CONFIG):
+    pending = pending_versions(config)
+    for version, name, _ in MIGRATIONS:
+        print(f"{version:03d} {'pending' if version in pending else 'applied':8} {name}")
+    return pending
+
+def ensure_current(config=DB_CONFIG):
+    """Bring the schema up to date before an app serves; raises RuntimeError if it is not.
+
+    With MIGRATE_ON_START=0 nothing is applied, only checked (for sites that
+    run `python migrate.py` themselves before a deploy).
+    """
+    try:
+        if os.getenv("MIGRATE_ON_START", "1") == "1":
+            apply_pending(config)
+        pending = pending_versions(config)
+    except Exception as e:
+        raise RuntimeError(f"could not apply schema migrations: {e}") from e
+    if pending:
+        raise RuntimeError("schema migrations pending: " + ", ".join(f"{v:03d}" for v in pending) +
+                           " (run `python migrate.py`)")
+
+# ---------------------- Index check ----------------------
+# The lookups both apps run on every scan / dashboard refresh, in the
+# sargable forms the migrations above exist for
+HOT_QUERIES = [
+    ("student by suffix", "SELECT * FROM students WHERE reg_suffix5 = %s", ("00001",)),
+    ("open log of a user", "SELECT role FROM logs WHERE full_reg_no = %s AND is_open = 1 LIMIT 1", ("0",)),
+    ("users inside", "SELECT full_reg_no, name FROM logs WHERE is_open = 1", ()),
+    ("active users with faculty email", """
+        SELECT l.full_reg_no, f.email FROM logs l
+        LEFT JOIN faculty f ON l.reg_suffix4 = f.full_reg_no
+        WHERE l.is_open = 1""", ()),
+    ("user history page", """
+        (SELECT id, entry_date, entry_time FROM logs WHERE reg_suffix5 = %s AND role = 'Student'
+         ORDER BY entry_date DESC, entry_time DESC, id DESC LIMIT 51)
+        UNION ALL
+        (SELECT id, entry_date, entry_time FROM logs WHERE reg_suffix4 = %s AND role = 'Faculty'
+         ORDER BY entry_date DESC, entry_time DESC, id DESC LIMIT 51)""", ("00001", "0001")),
+    ("entries of a day", "SELECT * FROM logs WHERE entry_date = CURDATE() ORDER BY entry_time", ()),
+    ("entries of a range", "SELECT * FROM logs WHERE entry_date BETWEEN CURDATE() - INTERVAL 30 DAY AND CURDATE()", ()),
+    ("archived entries of a range",
+     "SELECT * FROM logs_archive WHERE entry_date BETWEEN CURDATE() - INTERVAL 400 DAY AND CURDATE()", ()),
+    ("next archive batch", """
+        SELECT id FROM logs WHERE entry_date < CURDATE() - INTERVAL 365 DAY AND is_open = 0
+        ORDER BY entry_date LIMIT 5000""", ()),
+]
+
+def explain(config=DB_CONFIG):
+    """EXPLAIN every hot query; returns {name: plan rows of the real tables it reads}"""
+    conn = mysql.connector.connect(**config)
+    cur = conn.cursor(dictionary=True, buffered=True)
+    plans = {}
+    try:
+        for name, query, params in HOT_QUERIES:
+            cur.execute("EXPLAIN " + query, params)
+            # Derived tables and UNION RESULT rows have no index of their own
+            plans[name] = [row for row in cur.fetchall() if row["table"] and not row["table"].startswith("<")]
+    finally:
+        cur.close()
+        conn.close()
+    return plans
+
+def check(config=DB_CONFIG):
+    """Print each hot query's plan; returns the names of those that scan a table without an index"""
+    failures = []
+    for name, plan in explain(config).items():
+        unindexed = [row["table"] for row in plan if row["key"] is None]
+        print(f"{'FAIL' if unindexed else 'ok':4}  {name}: " +
+              ", ".join(f"{row['table']}={row['key']}" for row in plan))
+        if unindexed:
+            failures.append(name)
+    return failures
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "up"
+    if command == "up":
+        applied = apply_pending()
+        print(f"Applied {len(applied)} migration(s)." if applied else "Schema is up to date.")
+    elif command == "status":
+        status()
+    elif command == "check":
+        # On a near-empty database MySQL may prefer a table scan; run this against real
+        # data (tests/test_migrations.py seeds a test database for the same check)
+        sys.exit(1 if check() else 0)
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -0,0 +1,391 @@
+"""Statement-level profiling for the library apps' MySQL queries.
+
+    profiler = query_profiler.QueryProfiler("admin")
+    conn = profiler.wrap(mysql.connector.connect(**DB_CONFIG))
+    ...
+    profiler.flush(other_conn)      # from a background job, every minute or so
+
+Every statement run on a wrapped connection is timed (execute plus fetching
+its rows), its rows are counted, and it is attributed to the Flask endpoint
+that ran it, or outside a request to the job given with label() or else the
+outermost app function on the stack. Statements are grouped by template: the
+SQL with whitespace collapsed and literals and IN lists replaced.
+
+Statements slower than SLOW_QUERY_MS are printed and kept as samples, with
+the types and lengths of their parameters rather than the values (student
+numbers, names); QUERY_PROFILE_RAW_PARAMS=1 keeps the values, except for
+statements on password columns. flush() adds the in-process aggregates to
+query_stats (one row per day, app, route and template) and stores the
+samples in slow_queries together with an EXPLAIN of the statement, taken at
+most once per template every EXPLAIN_INTERVAL_SECONDS. Samples are kept
+SLOW_QUERY_KEEP_DAYS days, and at most SLOW_QUERY_KEEP_ROWS of them. Admin's
+/api/query_stats (token-protected) reads both tables, so it sees every
+worker of both apps.
+
+QUERY_PROFILING=0 turns wrap() into a no-op.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime
+from functools import lru_cache
+import mysql.connector
+
+PROFILING = os.getenv("QUERY_PROFILING", "1") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+EXPLAIN_INTERVAL_SECONDS = int(os.getenv("EXPLAIN_INTERVAL_SECONDS", "600"))
+SLOW_QUERY_KEEP_DAYS = int(os.getenv("SLOW_QUERY_KEEP_DAYS", "14"))
+SLOW_QUERY_KEEP_ROWS = int(os.getenv("SLOW_QUERY_KEEP_ROWS", "5000"))
+RAW_PARAMS = os.getenv("QUERY_PROFILE_RAW_PARAMS", "0") == "1"
+SLOW_SAMPLES = 200          # slow statements kept between two flushes
+PARAMS_TEXT_LIMIT = 500
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# ---------------------- Templates ----------------------
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_SECRET = re.compile(r"\bpass(word)?\b", re.IGNORECASE)
+_EXPLAINABLE = re.compile(r"^\s*\(?\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b", re.IGNORECASE)
+
+@lru_cache(maxsize=2048)
+def normalize(sql):
+    """Query template: one line, literals as ?, placeholder lists as (...)"""
+    text = " ".join(sql.split())
+    text = _STRING.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    return _LIST.sub("(...)", text)
+
+def template_hash(template):
+    return hashlib.sha1(template.encode("utf-8")).hexdigest()
+
+def _value_shape(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, (str, bytes, bytearray)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+def params_shape(params, many=False):
+    """Parameters as types and lengths, e.g. "(str[10], date)", without their values"""
+    if many:
+        rows = list(params) if params is not None else []
+        return f"{len(rows)} x {params_shape(rows[0])}" if rows else "0 rows"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {_value_shape(value)}" for key, value in params.items()) + "}"
+    if isinstance(params, (tuple, list)):
+        return "(" + ", ".join(_value_shape(value) for value in params) + ")"
+    return _value_shape(params)
+
+def params_text(sql, params, many=False):
+    if RAW_PARAMS and not _SECRET.search(sql):
+        text = repr(params)
+    else:
+        text = params_shape(params, many)
+    return text if len(text) <= PARAMS_TEXT_LIMIT else text[:PARAMS_TEXT_LIMIT] + "..."
+
+# ---------------------- Route of a statement ----------------------
+_label = threading.local()
+
+@contextmanager
+def label(name):
+    """Attribute the statements run inside the block to `name` (e.g. a job)"""
+    previous = getattr(_label, "name", None)
+    _label.name = name
+    try:
+        yield
+    finally:
+        _label.name = previous
+
+def _is_app_frame(frame):
+    path = frame.f_code.co_filename
+    return path.startswith(ROOT) and path != __file__ and "site-packages" not in path
+
+def current_route():
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return request.endpoint or request.path
+    except ImportError:
+        pass
+    name = getattr(_label, "name", None)
+    if name:
+        return name
+    # Background thread: the outermost app function, i.e. the job itself
+    outermost = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        if _is_app_frame(frame) and frame.f_code.co_name != "<module>":
+            outermost = frame.f_code.co_name
+        frame = frame.f_back
+    return f"job:{outermost}" if outermost else "-"
+
+# ---------------------- Wrappers ----------------------
+class ProfiledCursor:
+    """A mysql.connector cursor that reports every statement to its profiler.
+
+    Buffered cursors and statements without a result set are recorded as
+    soon as execute returns. Unbuffered results are recorded once they are
+    read to the end, the next statement runs or the cursor is closed, so
+    the time spent fetching rows counts too.
+    """
+
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+        self._buffered = "Buffered" in type(cursor).__name__
+        self._pending = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending:
+            self._profiler.record(pending["sql"], pending["params"], pending["elapsed"], pending["rows"],
+                                  route=pending["route"])
+
+    def _run(self, method, many, operation, params, *args, **kwargs):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            result = method(operation, params, *args, **kwargs)
+        except mysql.connector.Error:
+            self._profiler.record(operation, params, time.perf_counter() - started, 0, error=True, many=many)
+            raise
+        elapsed = time.perf_counter() - started
+        if many or self._buffered or not self._cursor.with_rows:
+            self._profiler.record(operation, params, elapsed, max(self._cursor.rowcount, 0), many=many)
+        else:
+            # Streamed responses read their rows after the request context is gone
+            self._pending = {"sql": operation, "params": params, "elapsed": elapsed, "rows": 0,
+                             "route": current_route()}
+        return result
+
+    def execute(self, operation, params=(), *args, **kwargs):
+        return self._run(self._cursor.execute, False, operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        return self._run(self._cursor.executemany, True, operation, seq_params, *args, **kwargs)
+
+    def _fetch(self, method, read_all, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        if self._pending:
+            self._pending["elapsed"] += time.perf_counter() - started
+            if isinstance(result, list):
+                self._pending["rows"] += len(result)
+            elif result is not None:
+                self._pending["rows"] += 1
+            if read_all or not result:
+                self._finish()
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone, False)
+
+    def fetchmany(self, size=1):
+        return self._fetch(self._cursor.fetchmany, False, size)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall, True)
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+
+class ProfiledConnection:
+    """A mysql.connector connection whose cursors are ProfiledCursors"""
+
+    def __init__(self, conn, profiler):
+        self._conn = conn
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return ProfiledCursor(self._conn.cursor(*args, **kwargs), self._profiler)
+
+# ---------------------- Profiler ----------------------
+class QueryProfiler:
+    """Per-process statement aggregates and slow samples of one app"""
+
+    def __init__(self, app):
+        self.app = app
+        self._stats = {}        # (route, template) -> [calls, errors, total_ms, max_ms, rows, slow_calls]
+        self._slow = deque(maxlen=SLOW_SAMPLES)
+        self._plans = {}        # template hash -> (captured at, plan)
+        self._lock = threading.Lock()
+        self._tables_ready = False
+
+    def wrap(self, conn):
+        return ProfiledConnection(conn, self) if PROFILING and conn is not None else conn
+
+    def record(self, sql, params, elapsed, rows, error=False, many=False, route=None):
+        if isinstance(sql, bytes):
+            sql = sql.decode("utf-8", "replace")
+        ms = elapsed * 1000
+        route = route or current_route()
+        template = normalize(sql)
+        slow = ms >= SLOW_QUERY_MS
+        shown_params = params_text(sql, params, many) if slow else None
+        with self._lock:
+            stat = self._stats.setdefault((route, template), [0, 0, 0.0, 0.0, 0, 0])
+            stat[0] += 1
+            stat[1] += error
+            stat[2] += ms
+            stat[3] = max(stat[3], ms)
+            stat[4] += rows
+            stat[5] += slow
+            if slow:
+                self._slow.append({"route": route, "template": template, "sql": sql,
+                                   "params": shown_params, "ms": ms, "rows": rows,
+                                   "at": datetime.now(),
+                                   # A batch has no single plan; DDL and lock functions have none
+                                   "explain": None if many or not _EXPLAINABLE.match(sql) else params or ()})
+        if slow:
+            print(f"[SLOW QUERY] {ms:.0f} ms, {rows} rows, {route}: {' '.join(sql.split())[:300]} "
+                  f"params={shown_params}")
+
+    def snapshot(self):
+        """This process's aggregates since the last flush, slowest total first"""
+        with self._lock:
+            items = list(self._stats.items())
+        return sorted(({"app": self.app, "route": route, "template": template, "calls": s[0], "errors": s[1],
+                        "total_ms": round(s[2], 1), "max_ms": round(s[3], 1), "rows": s[4], "slow_calls": s[5]}
+                       for (route, template), s in items), key=lambda s: -s["total_ms"])
+
+    def ensure_tables(self, cur):
+        if self._tables_ready:
+            return
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS query_stats (
+                stat_date DATE NOT NULL,
+                app VARCHAR(32) NOT NULL,
+                route VARCHAR(128) NOT NULL,
+                template_hash CHAR(40) NOT NULL,
+                template TEXT NOT NULL,
+                calls BIGINT NOT NULL DEFAULT 0,
+                errors INT NOT NULL DEFAULT 0,
+                total_ms DOUBLE NOT NULL DEFAULT 0,
+                max_ms DOUBLE NOT NULL DEFAULT 0,
+                rows_total BIGINT NOT NULL DEFAULT 0,
+                slow_calls INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (stat_date, app, route, template_hash)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS slow_queries (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                captured_at DATETIME NOT NULL,
+                app VARCHAR(32) NOT NULL,
+                route VARCHAR(128) NOT NULL,
+                template_hash CHAR(40) NOT NULL,
+                statement TEXT NOT NULL,
+                params TEXT,
+                duration_ms DOUBLE NOT NULL,
+                rows_count INT,
+                plan MEDIUMTEXT,
+                KEY idx_slow_queries_time (captured_at),
+                KEY idx_slow_queries_template (template_hash, captured_at)
+            )
+        """)
+        self._tables_ready = True
+
+    def _explain(self, cur, sample, digest):
+        """EXPLAIN of a slow statement, reused for its template for EXPLAIN_INTERVAL_SECONDS"""
+        cached = self._plans.get(digest)
+        if cached and time.monotonic() - cached[0] < EXPLAIN_INTERVAL_SECONDS:
+            return cached[1]
+        if sample["explain"] is None:
+            return None
+        try:
+            cur.execute("EXPLAIN " + sample["sql"], sample["explain"])
+            columns = cur.column_names
+            plan = json.dumps([dict(zip(columns, row)) for row in cur.fetchall()], default=str)
+        except mysql.connector.Error as e:
+            plan = json.dumps({"error": e.msg})
+        self._plans[digest] = (time.monotonic(), plan)
+        return plan
+
+    def _expire_slow_queries(self, cur):
+        """Drop samples older than SLOW_QUERY_KEEP_DAYS, then all but the newest SLOW_QUERY_KEEP_ROWS"""
+        cur.execute("DELETE FROM slow_queries WHERE captured_at < NOW() - INTERVAL %s DAY", (SLOW_QUERY_KEEP_DAYS,))
+        # MySQL cannot read the table it deletes from in a subquery, but can in a derived table
+        cur.execute("""
+            DELETE FROM slow_queries WHERE id <= (
+                SELECT id FROM (SELECT id FROM slow_queries ORDER BY id DESC LIMIT 1 OFFSET %s) AS newest
+            )
+        """, (SLOW_QUERY_KEEP_ROWS,))
+
+    def flush(self, conn):
+        """Add the aggregates and slow samples gathered since the last flush to the database,
+        and expire old samples"""
+        conn = getattr(conn, "_conn", conn)  # the profiler's own statements are not profiled
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            slow = list(self._slow)
+            self._slow.clear()
+        cur = conn.cursor(buffered=True)
+        try:
+            self.ensure_tables(cur)
+            today = date.today()
+            if stats:
+                cur.executemany("""
+                    INSERT INTO query_stats
+                        (stat_date, app, route, template_hash, template, calls, errors, total_ms, max_ms, rows_total, slow_calls)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE calls = calls + VALUES(calls), errors = errors + VALUES(errors),
+                        total_ms = total_ms + VALUES(total_ms), max_ms = GREATEST(max_ms, VALUES(max_ms)),
+                        rows_total = rows_total + VALUES(rows_total), slow_calls = slow_calls + VALUES(slow_calls)
+                """, [(today, self.app, route[:128], template_hash(template), template, *s)
+                      for (route, template), s in stats.items()])
+            for sample in slow:
+                digest = template_hash(sample["template"])
+                cur.execute("""
+                    INSERT INTO slow_queries
+                        (captured_at, app, route, template_hash, statement, params, duration_ms, rows_count, plan)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (sample["at"], self.app, sample["route"][:128], digest, sample["sql"], sample["params"],
+                      sample["ms"], sample["rows"], self._explain(cur, sample, digest)))
+            self._expire_slow_queries(cur)
+            conn.commit()
+        except mysql.connector.Error as e:
+            conn.rollback()
+            # Keep the counts for the next flush
+            with self._lock:
+                for key, s in stats.items():
+                    stat = self._stats.setdefault(key, [0, 0, 0.0, 0.0, 0, 0])
+                    stat[0] += s[0]
+                    stat[1] += s[1]
+                    stat[2] += s[2]
+                    stat[3] = max(stat[3], s[3])
+                    stat[4] += s[4]
+                    stat[5] += s[5]
+            print("Could not store query stats:", e)
+            return 0
+        finally:
+            cur.close()
+        return len(stats)
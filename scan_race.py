@@ -0,0 +1,144 @@
+"""Concurrency check for kiosk scans against a local MySQL database.
+
+    python scan_race.py                      fire parallel /check scans in-process
+    python scan_race.py --url http://localhost:5000
+                                             ... at a running kiosk (serve.py students)
+    python scan_race.py --users 5 --threads 8 --rounds 10
+
+Picks students that are not inside and whose 5-digit code is unique, then
+for each round has every thread post /check for the same card at the same
+moment (a barrier lines them up). Afterwards it asserts that no card has
+more than one open log (is_open = 1) and that no scan failed, prints ok or
+FAIL per card like `migrate.py check`, and exits 1 on a failure.
+
+Writes real log rows: run it against a development copy of lib_main. The
+rows it added are deleted at the end unless --keep is given. In-process
+runs ignore the library hours; against --url it must run during them.
+tests/test_scan_race.py runs the same check under pytest on a test database.
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# The kiosk page shows the flashed outcome in this element
+TOAST = re.compile(r'id="toast" data-message="([^"]*)" data-error="(true|false)"')
+
+# The check is about the transactional path, not the write-behind journal
+os.environ['KIOSK_WRITE_BEHIND'] = '0'
+
+
+def load_kiosk():
+    sys.path.insert(0, ROOT)
+    import serve
+    students = serve.load_app_module('students')
+    students.LIBRARY_OPEN_HOUR, students.LIBRARY_CLOSE_HOUR = 0, 24
+    if not students.roster.load():
+        raise SystemExit("Could not load the roster; is MySQL running?")
+    return students
+
+
+def pick_users(students, count):
+    """Students outside the library whose 5-digit code matches only them"""
+    rows = students.execute_query("""
+        SELECT MIN(s.full_reg_no) AS full_reg_no FROM students s
+        WHERE NOT EXISTS (SELECT 1 FROM logs l WHERE l.full_reg_no = s.full_reg_no AND l.is_open = 1)
+        GROUP BY s.reg_suffix5 HAVING COUNT(*) = 1
+        LIMIT %s""", (count,), fetch=True)
+    return [str(row['full_reg_no']) for row in rows or []]
+
+
+def post_scan(target, full_reg_no):
+    """POST /check for a student card; returns the flashed outcome ('success'/'error') or None"""
+    form = {'registry_last_digits': full_reg_no[-5:], 'role': 'Student'}
+    if isinstance(target, str):
+        # The flash travels in the session cookie to the page /check redirects to
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor())
+        data = urllib.parse.urlencode(form).encode()
+        with opener.open(target.rstrip('/') + '/check', data=data, timeout=30) as response:
+            page = response.read().decode('utf-8', 'replace')
+        toast = TOAST.search(page)
+        if not toast or not toast.group(1):
+            return None
+        return 'error' if toast.group(2) == 'true' else 'success'
+    with target.test_client() as client:
+        client.post('/check', data=form)
+        with client.session_transaction() as session:
+            flashes = session.get('_flashes') or [(None, None)]
+        return flashes[0][0]
+
+
+def run(target, users, threads, rounds):
+    """Scan every user from `threads` threads at once, `rounds` times; returns the failed scans"""
+    barrier = threading.Barrier(threads)
+    failures = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(rounds):
+            for full_reg_no in users:
+                barrier.wait()
+                try:
+                    outcome = post_scan(target, full_reg_no)
+                except Exception as e:
+                    outcome = f"exception: {e}"
+                if outcome != 'success':
+                    with lock:
+                        failures.append((full_reg_no, outcome))
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return failures
+
+
+def check(students, users, first_id):
+    """Names of the cards left with more than one open log"""
+    bad = []
+    for full_reg_no in users:
+        row = students.execute_query("""
+            SELECT COUNT(*) AS scans, COALESCE(SUM(is_open), 0) AS open_logs FROM logs
+            WHERE full_reg_no = %s AND id > %s""", (full_reg_no, first_id), fetch_one=True)
+        open_logs = int(row['open_logs'])
+        print(f"{'FAIL' if open_logs > 1 else 'ok':4}  {full_reg_no}: {row['scans']} log rows, {open_logs} open")
+        if open_logs > 1:
+            bad.append(full_reg_no)
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fire parallel kiosk scans and check for duplicate open logs.")
+    parser.add_argument('--url', help="kiosk base URL (default: run the app in-process)")
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help="keep the log rows the run added")
+    args = parser.parse_args()
+
+    students = load_kiosk()
+    users = pick_users(students, args.users)
+    if not users:
+        raise SystemExit("No student outside the library with a unique code to scan.")
+    first_id = students.execute_query("SELECT COALESCE(MAX(id), 0) AS id FROM logs", fetch_one=True)['id']
+
+    print(f"Scanning {len(users)} cards from {args.threads} threads, {args.rounds} rounds")
+    failures = run(args.url or students.app, users, args.threads, args.rounds)
+    bad = check(students, users, first_id)
+    for full_reg_no, outcome in failures:
+        print(f"scan of {full_reg_no} failed: {outcome}")
+
+    if not args.keep:
+        placeholders = ", ".join(["%s"] * len(users))
+        students.execute_query(f"DELETE FROM logs WHERE id > %s AND full_reg_no IN ({placeholders})",
+                               (first_id, *users))
+    sys.exit(1 if bad or failures else 0)
+
+
+if __name__ == '__main__':
+    main()
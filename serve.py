@@ -0,0 +1,154 @@
+"""Production entry point for the library apps.
+
+    python serve.py students --threads 16
+    python serve.py admin --workers 4 --bind 0.0.0.0:5001
+    python serve.py dev
+
+Serves the same Flask `app` objects as students.py / admin.py / dev.py, but
+under gunicorn (Linux) with the given worker and thread counts instead of the
+Werkzeug debug server. Where gunicorn is not installed (e.g. Windows) it falls
+back to waitress, which is multi-threaded but single-process.
+
+The kiosk runs as one worker with threads by default: its occupancy registry
+is per process and is what /api/stream, /api/occupancy deltas and the
+write-behind journal (KIOSK_WRITE_BEHIND=1, which refuses more workers) rely
+on. With several kiosk workers each one only sees its own scans until the
+next reconcile (OCCUPANCY_RECONCILE_SECONDS). Admin and dev default to
+WEB_WORKERS (2) workers.
+
+Pending schema migrations (migrate.py) are applied once before any worker
+starts; if that fails serve.py exits with status 1. Each worker calls the
+app's warm_up() before it accepts traffic (schema check, pool, caches,
+background jobs), which stops the worker from booting on an out-of-date
+schema, and shutdown() when it exits, so pending background work is flushed.
+Debug stays off unless APP_DEBUG=1.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (folder, module, default port, default workers)
+APPS = {
+    'students': ('Students', 'students', 5000, 1),
+    'admin': ('Admin', 'admin', 5001, None),
+    'dev': ('dev_panel', 'dev', 5002, None),
+}
+
+
+def load_app_module(name):
+    """Import an app module from its folder (the apps use cwd-relative paths)"""
+    folder, module = APPS[name][:2]
+    app_dir = os.path.join(ROOT, folder)
+    os.chdir(app_dir)
+    if app_dir not in sys.path:
+        sys.path.insert(0, app_dir)
+    return importlib.import_module(module)
+
+
+def call_hook(module, hook):
+    func = getattr(module, hook, None)
+    if func:
+        func()
+
+
+def run_gunicorn(name, bind, workers, threads, timeout):
+    from gunicorn.app.base import BaseApplication
+
+    if name == 'students' and workers > 1 and os.getenv('KIOSK_WRITE_BEHIND', '0') == '1':
+        # Each worker would decide scans from its own registry and share one journal file
+        sys.exit("KIOSK_WRITE_BEHIND=1 needs a single kiosk worker: use --workers 1 (and more --threads).")
+
+    class LibraryApplication(BaseApplication):
+        module = None
+
+        def load_config(self):
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread' if threads > 1 else 'sync')
+            self.cfg.set('timeout', timeout)
+            self.cfg.set('graceful_timeout', timeout)
+            self.cfg.set('post_worker_init', lambda worker: call_hook(self.module, 'warm_up'))
+            self.cfg.set('worker_exit', lambda server, worker: call_hook(self.module, 'shutdown'))
+
+        def load(self):
+            # Runs inside each worker (no preload), so every worker has its own
+            # pool, caches and scheduler
+            self.module = load_app_module(name)
+            return self.module.app
+
+    LibraryApplication().run()
+
+
+def run_waitress(name, bind, threads):
+    from waitress import serve
+
+    module = load_app_module(name)
+    call_hook(module, 'warm_up')
+    try:
+        serve(module.app, listen=bind, threads=threads)
+    finally:
+        call_hook(module, 'shutdown')
+
+
+def run_flask(name, bind, threads):
+    module = load_app_module(name)
+    host, port = bind.rsplit(':', 1)
+    call_hook(module, 'warm_up')
+    try:
+        module.app.run(host=host, port=int(port), debug=False, threaded=threads > 1)
+    finally:
+        call_hook(module, 'shutdown')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a library app for production use.")
+    parser.add_argument('app', choices=sorted(APPS))
+    parser.add_argument('--bind', help="host:port (default 0.0.0.0:<app port>)")
+    parser.add_argument('--workers', type=int,
+                        help="worker processes (default: 1 for students, else WEB_WORKERS or 2)")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', '8')))
+    parser.add_argument('--timeout', type=int, default=int(os.getenv('WEB_TIMEOUT', '120')))
+    parser.add_argument('--skip-migrations', action='store_true',
+                        help="don't apply pending schema migrations, only refuse to start if any are pending")
+    args = parser.parse_args()
+
+    if args.skip_migrations:
+        # Read by migrate.ensure_current() in each worker's warm_up()
+        os.environ['MIGRATE_ON_START'] = '0'
+    else:
+        import migrate
+        try:
+            migrate.apply_pending()
+        except Exception as e:
+            sys.exit(f"Could not apply schema migrations: {e}")
+
+    bind = args.bind or f"0.0.0.0:{APPS[args.app][2]}"
+    if args.workers is None:
+        args.workers = APPS[args.app][3] or int(os.getenv('WEB_WORKERS', '2'))
+    if args.app == 'students' and args.workers > 1:
+        print("Warning: kiosk workers keep separate occupancy registries; live updates from "
+              "other workers arrive only at the next reconcile.")
+    print(f"Serving {args.app} on {bind} ({args.workers} workers x {args.threads} threads)")
+
+    try:
+        import gunicorn  # noqa: F401
+        run_gunicorn(args.app, bind, args.workers, args.threads, args.timeout)
+        return
+    except ImportError:
+        pass
+
+    try:
+        import waitress  # noqa: F401
+        print("gunicorn not available, using waitress (threads only).")
+        run_waitress(args.app, bind, args.threads)
+    except ImportError:
+        print("Neither gunicorn nor waitress is installed, using the threaded Flask server.")
+        run_flask(args.app, bind, args.threads)
+
+
+if __name__ == '__main__':
+    main()
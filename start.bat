@@ -7,17 +7,17 @@ start "" .\xampp_start.exe
 REM === Step 2: Run app.py inside MAIN folder ===
 cd /d "C:\xampp\htdocs\lib2\Students"
 echo Running MAIN app.py...
-start cmd /k "python students.py"
+start cmd /k "python ..\serve.py students"
 
 REM === Step 3: Run app.py inside admin folder ===
 cd /d "C:\xampp\htdocs\lib2\Admin"
 echo Running ADMIN app.py...
-start cmd /k "python admin.py"
+start cmd /k "python ..\serve.py admin"
 
 REM === Step 4: Run app.py inside devpanel folder ===
 cd /d "C:\xampp\htdocs\lib2\dev_panel"
 echo Running ADMIN app.py...
-start cmd /k "python dev.py"
+start cmd /k "python ..\serve.py dev"
 
 
 REM === Step 5: Wait 3 seconds ===
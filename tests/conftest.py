@@ -0,0 +1,96 @@
+"""Fixtures for the tests that need a real MySQL server.
+
+They run against a throwaway database named by LIB_TEST_DB, which is dropped
+and recreated (base tables plus every migration) at the start of the run;
+the server is reached with the same DB_HOST / DB_USER / DB_PASS as the
+Admin app. Without LIB_TEST_DB these tests are skipped:
+
+    LIB_TEST_DB=lib_test python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Tables the apps expect before the migrations run (they predate migrate.py)
+BASE_SCHEMA = [
+    """CREATE TABLE students (
+           full_reg_no BIGINT PRIMARY KEY,
+           name VARCHAR(255) NOT NULL,
+           branch VARCHAR(128),
+           year VARCHAR(16)
+       )""",
+    """CREATE TABLE faculty (
+           full_reg_no INT PRIMARY KEY,
+           name VARCHAR(255) NOT NULL,
+           email VARCHAR(255)
+       )""",
+    """CREATE TABLE logs (
+           id INT AUTO_INCREMENT PRIMARY KEY,
+           full_reg_no VARCHAR(32) NOT NULL,
+           name VARCHAR(255),
+           branch VARCHAR(128),
+           year VARCHAR(16),
+           role VARCHAR(16),
+           entry_date DATE,
+           entry_time TIME,
+           exit_date DATE,
+           exit_time TIME
+       )""",
+    """CREATE TABLE password (
+           id VARCHAR(64) PRIMARY KEY,
+           pass VARCHAR(255) NOT NULL
+       )""",
+]
+
+
+@pytest.fixture(scope="session")
+def db_config():
+    """Connection settings of a freshly created and migrated test database"""
+    name = os.getenv("LIB_TEST_DB")
+    if not name:
+        pytest.skip("set LIB_TEST_DB to a throwaway database name to run the MySQL tests")
+    if name == "lib_main":
+        pytest.fail("LIB_TEST_DB is dropped and recreated; do not point it at lib_main")
+
+    import mysql.connector
+    import migrate
+
+    server = {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "user": os.getenv("DB_USER", "root"),
+        "password": os.getenv("DB_PASS", ""),
+    }
+    try:
+        conn = mysql.connector.connect(**server)
+    except mysql.connector.Error as e:
+        pytest.skip(f"MySQL not reachable: {e}")
+    cur = conn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS `{name}`")
+    cur.execute(f"CREATE DATABASE `{name}`")
+    cur.execute(f"USE `{name}`")
+    for statement in BASE_SCHEMA:
+        cur.execute(statement)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    config = dict(server, database=name)
+    migrate.apply_pending(config)
+    return config
+
+
+@pytest.fixture(scope="session")
+def kiosk(db_config):
+    """The Students app module, pointed at the test database"""
+    os.environ["KIOSK_WRITE_BEHIND"] = "0"
+    import serve
+    students = serve.load_app_module("students")
+    # Before the pool opens its first connection
+    students.DB_CONFIG.update(db_config)
+    students.db_pool.config.update(db_config)
+    students.ensure_meta_table()
+    return students
@@ -0,0 +1,96 @@
+"""The migrations' indexes are what the hot queries use (user-015).
+
+EXPLAIN needs data to be meaningful (on a near-empty table MySQL prefers a
+scan), so the module seeds a year of logs plus archived history first.
+"""
+import random
+from datetime import date, time, timedelta
+
+import mysql.connector
+import pytest
+
+import migrate
+
+STUDENTS = 5000
+FACULTY = 2000
+LOG_DAYS = 400          # logs: archiving moves rows older than a year out daily
+LOGS_PER_DAY = 75
+ARCHIVE_DAYS = (366, 1800)
+OPEN_TODAY = 10
+# Cards 2000020000.. so their 5-digit codes stay clear of test_scan_race's
+FIRST_STUDENT = 2000020000
+
+
+def log_row(rng, day, open_log=False):
+    if rng.random() < 0.1:
+        code = rng.randint(1, FACULTY)
+        who = (str(code), f"Faculty {code}", None, None, "Faculty")
+    else:
+        reg = FIRST_STUDENT + rng.randrange(STUDENTS)
+        who = (str(reg), f"Student {reg}", "CSE", str(rng.randint(1, 4)), "Student")
+    entry = time(rng.randint(7, 18), rng.randint(0, 59), rng.randint(0, 59))
+    if open_log:
+        return (*who, day, entry, None, None)
+    return (*who, day, entry, day, time(min(entry.hour + 2, 20), entry.minute, entry.second))
+
+
+def seed(config):
+    rng = random.Random(15)
+    today = date.today()
+    insert_log = """INSERT INTO {} (full_reg_no, name, branch, year, role,
+                                    entry_date, entry_time, exit_date, exit_time)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+    conn = mysql.connector.connect(**config)
+    cur = conn.cursor()
+    try:
+        cur.executemany("INSERT INTO students (full_reg_no, name, branch, year) VALUES (%s, %s, 'CSE', '1')",
+                        [(FIRST_STUDENT + i, f"Student {i}") for i in range(STUDENTS)])
+        cur.executemany("INSERT INTO faculty (full_reg_no, name, email) VALUES (%s, %s, %s)",
+                        [(code, f"Faculty {code}", f"f{code}@example.edu") for code in range(1, FACULTY + 1)])
+        logs = [log_row(rng, today - timedelta(days=age))
+                for age in range(1, LOG_DAYS) for _ in range(LOGS_PER_DAY)]
+        logs += [log_row(rng, today, open_log=i < OPEN_TODAY) for i in range(LOGS_PER_DAY)]
+        cur.executemany(insert_log.format("logs"), logs)
+        archived = [log_row(rng, today - timedelta(days=age))
+                    for age in range(*ARCHIVE_DAYS) for _ in range(LOGS_PER_DAY // 3)]
+        cur.executemany(insert_log.format("logs_archive"), archived)
+        conn.commit()
+        cur.execute("ANALYZE TABLE students, faculty, logs, logs_archive")
+        cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+@pytest.fixture(scope="module")
+def plans(db_config):
+    seed(db_config)
+    return migrate.explain(db_config)
+
+
+@pytest.mark.parametrize("name", [name for name, _, _ in migrate.HOT_QUERIES])
+def test_hot_query_uses_an_index(plans, name):
+    plan = plans[name]
+    assert plan, f"{name}: EXPLAIN returned no table rows"
+    unindexed = [row["table"] for row in plan if row["key"] is None]
+    assert not unindexed, f"{name} scans {unindexed}: " + \
+        ", ".join(f"{row['table']}={row['key']} ({row['type']})" for row in plan)
+
+
+def test_ensure_current_refuses_a_pending_schema(db_config, monkeypatch):
+    migrate.ensure_current(db_config)
+
+    conn = mysql.connector.connect(**db_config)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM schema_migrations WHERE version = %s", (migrate.MIGRATIONS[-1][0],))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    monkeypatch.setenv("MIGRATE_ON_START", "0")
+    with pytest.raises(RuntimeError, match="pending"):
+        migrate.ensure_current(db_config)
+    # Applying is the default; every migration is safe to re-run
+    monkeypatch.setenv("MIGRATE_ON_START", "1")
+    migrate.ensure_current(db_config)
+    assert migrate.pending_versions(db_config) == []
@@ -0,0 +1,29 @@
+"""Parallel kiosk scans of the same cards never leave two open logs (user-004)."""
+import scan_race
+
+CARDS = ["1000010001", "1000010002", "1000010003"]
+
+
+def test_parallel_scans_keep_one_open_log_per_card(kiosk, monkeypatch):
+    for full_reg_no in CARDS:
+        kiosk.execute_query("INSERT INTO students (full_reg_no, name, branch, year) VALUES (%s, %s, 'CSE', '2')",
+                            (full_reg_no, f"Student {full_reg_no[-2:]}"))
+    # Scans outside 7 AM - 8 PM are refused, whatever time the test runs
+    monkeypatch.setattr(kiosk, "LIBRARY_OPEN_HOUR", 0)
+    monkeypatch.setattr(kiosk, "LIBRARY_CLOSE_HOUR", 24)
+    assert kiosk.roster.load()
+    assert kiosk.occupancy.rebuild()
+
+    first_id = kiosk.execute_query("SELECT COALESCE(MAX(id), 0) AS id FROM logs", fetch_one=True)["id"]
+    failures = scan_race.run(kiosk.app, CARDS, threads=8, rounds=5)
+
+    assert failures == []
+    assert scan_race.check(kiosk, CARDS, first_id) == []
+    # 8 threads x 5 rounds of toggles per card: 40 scans, 20 entries, none left open
+    for full_reg_no in CARDS:
+        row = kiosk.execute_query("""SELECT COUNT(*) AS entries, COALESCE(SUM(is_open), 0) AS open_logs
+                                     FROM logs WHERE full_reg_no = %s AND id > %s""",
+                                  (full_reg_no, first_id), fetch_one=True)
+        assert (row["entries"], int(row["open_logs"])) == (20, 0)
+        # The registry was updated under the card's lock, in commit order
+        assert kiosk.occupancy.get(full_reg_no) is None